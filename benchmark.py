@@ -0,0 +1,318 @@
+# Benchmark chạy app trong tiến trình (httpx ASGITransport), không cần uvicorn.
+# Chạy trên một DB riêng vì script ghi dữ liệu thật; tạo schema trước bằng migrate.py:
+#   APP_DATABASE_URL=postgresql://.../bench python migrate.py
+#   APP_DATABASE_URL=postgresql://.../bench python benchmark.py bulk --rows 2000 --batch 500
+#   APP_DATABASE_URL=sqlite:///bench.db python benchmark.py crud --requests 500 --output crud.json
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import timeit
+from datetime import datetime, timedelta
+
+import httpx
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from config import settings
+from database import async_engine
+from migrate import upgrade
+import schemas
+from main import app
+
+
+def client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+
+async def seed_store(c):
+    r = await c.post("/stores/", json={"name": "Bench store", "location": "bench"})
+    r.raise_for_status()
+    page = (await c.get("/stores/", params={"location": "bench", "limit": 500})).json()
+    return page["items"][-1]["id"]
+
+
+def product_rows(n, store_id, tag):
+    return [{"name": f"{tag}-{i}", "price": 1.0 + i % 100, "store_id": store_id} for i in range(n)]
+
+
+# So sánh POST /products/ từng dòng với POST /products/bulk theo lô
+async def bench_bulk(rows, batch):
+    async with client() as c:
+        store_id = await seed_store(c)
+
+        start = time.perf_counter()
+        for item in product_rows(rows, store_id, "single"):
+            (await c.post("/products/", json=item)).raise_for_status()
+        single = time.perf_counter() - start
+
+        items = product_rows(rows, store_id, "bulk")
+        start = time.perf_counter()
+        for i in range(0, rows, batch):
+            r = await c.post("/products/bulk", json=items[i:i + batch])
+            r.raise_for_status()
+            assert not r.json()["errors"]
+        bulk = time.perf_counter() - start
+
+    print(f"single-row: {rows} rows in {single:.3f}s ({rows / single:,.0f} rows/s)")
+    print(f"bulk x{batch}: {rows} rows in {bulk:.3f}s ({rows / bulk:,.0f} rows/s)")
+    print(f"speed-up: {single / bulk:.1f}x")
+
+
+NOW = datetime(2024, 5, 17, 9, 30, 12, 345678)
+
+# Một dòng mẫu cho mỗi route danh sách
+SAMPLES = {
+    "/employees/": schemas.EmployeeRead(id=1, version=1, name="Nguyen Van A", position="cashier", store_id=3, is_active=True),
+    "/customers/": schemas.CustomerRead(id=1, version=1, name="Tran Thi B", email="b@example.com", is_active=True),
+    "/stores/": schemas.StoreRead(id=1, version=1, name="Store 12", location="Ha Noi"),
+    "/products/": schemas.ProductRead(id=1, version=1, name="Rice cooker 1.8L", price=59.9, store_id=3),
+    "/orders/": schemas.OrderRead(id=1, version=1, customer_id=7, product_id=9, quantity=2, total_price=119.8, order_date=NOW),
+    "/invoices/": schemas.InvoiceRead(id=1, version=1, order_id=1, amount=119.8, issued_date=NOW),
+    "/services/": schemas.ServiceRead(id=1, version=1, name="Installation", description="On-site installation"),
+    "/warranties/": schemas.WarrantyRead(id=1, version=1, product_id=9, service_id=1, valid_until=NOW),
+}
+
+
+# Chi phí render JSON cho mỗi route: encoder mặc định (json) so với orjson.
+# Bước pydantic model_dump(mode="json") giống nhau ở cả hai nên đo riêng.
+def bench_serialization(page_size, number):
+    print(f"{'route':<14}{'dump µs':>10}{'json µs':>10}{'orjson µs':>11}{'speed-up':>10}")
+    for route, sample in SAMPLES.items():
+        page = schemas.Page[type(sample)](items=[sample] * page_size, next_after_id=page_size)
+        content = page.model_dump(mode="json")
+        dump = timeit.timeit(lambda: page.model_dump(mode="json"), number=number) / number * 1e6
+        before = timeit.timeit(lambda: JSONResponse(content), number=number) / number * 1e6
+        after = timeit.timeit(lambda: ORJSONResponse(content), number=number) / number * 1e6
+        print(f"{route:<14}{dump:>10.1f}{before:>10.1f}{after:>11.1f}{before / after:>9.1f}x")
+
+
+FIRST_NAMES = ["Nguyen", "Tran", "Le", "Pham", "Hoang", "Vu", "Dang", "Bui", "Do", "Ngo"]
+LAST_NAMES = ["An", "Binh", "Chi", "Dung", "Giang", "Hanh", "Khoa", "Linh", "Minh", "Phuong", "Quan", "Thao"]
+CITIES = ["Ha Noi", "Ho Chi Minh", "Da Nang", "Hai Phong", "Can Tho", "Hue", "Nha Trang"]
+PRODUCTS = ["Rice cooker", "Electric fan", "Kettle", "Blender", "Air fryer", "Iron", "Vacuum cleaner", "Water filter"]
+POSITIONS = ["cashier", "sales", "stock", "manager"]
+
+
+def person(rng, i):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}"
+
+
+async def post_many(c, path, items, concurrency):
+    ids = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(item):
+        async with semaphore:
+            r = await c.post(path, json=item)
+            r.raise_for_status()
+            ids.append(r.json()["id"])
+
+    await asyncio.gather(*(post(item) for item in items))
+    return ids
+
+
+async def post_bulk(c, path, items):
+    ids = []
+    for i in range(0, len(items), settings.bulk_max_items):
+        r = await c.post(path, json=items[i:i + settings.bulk_max_items])
+        r.raise_for_status()
+        assert not r.json()["errors"], r.json()["errors"][:3]
+        ids.extend(row["id"] for row in r.json()["created"])
+    return ids
+
+
+# Dữ liệu nền: số dòng của mỗi bảng tỉ lệ với scale, giá và số lượng ngẫu nhiên (seed cố định)
+async def seed_data(c, rng, scale, concurrency):
+    ids = {}
+    ids["stores"] = await post_many(c, "/stores/", [
+        {"name": f"Store {i}", "location": rng.choice(CITIES)} for i in range(10 * scale)
+    ], concurrency)
+    ids["employees"] = await post_many(c, "/employees/", [
+        {"name": person(rng, i), "position": rng.choice(POSITIONS), "store_id": rng.choice(ids["stores"]), "is_active": True}
+        for i in range(50 * scale)
+    ], concurrency)
+    ids["services"] = await post_many(c, "/services/", [
+        {"name": f"Service {i}", "description": "Installation and repair"} for i in range(5 * scale)
+    ], concurrency)
+    ids["customers"] = await post_bulk(c, "/customers/bulk", [
+        {"name": person(rng, i), "email": f"customer{i}.{rng.randrange(10**6)}@example.com", "is_active": True}
+        for i in range(500 * scale)
+    ])
+    ids["products"] = await post_bulk(c, "/products/bulk", [
+        {"name": f"{rng.choice(PRODUCTS)} {i}", "price": round(rng.uniform(5, 500), 2), "store_id": rng.choice(ids["stores"])}
+        for i in range(500 * scale)
+    ])
+    ids["orders"] = await post_bulk(c, "/orders/bulk", [
+        {"customer_id": rng.choice(ids["customers"]), "product_id": rng.choice(ids["products"]), "quantity": rng.randint(1, 5)}
+        for _ in range(2000 * scale)
+    ])
+    ids["invoices"] = await post_many(c, "/invoices/", [
+        {"order_id": order_id, "amount": round(rng.uniform(5, 2500), 2)} for order_id in ids["orders"][:100 * scale]
+    ], concurrency)
+    ids["warranties"] = await post_many(c, "/warranties/", [
+        {"product_id": rng.choice(ids["products"]), "service_id": rng.choice(ids["services"]),
+         "valid_until": (NOW + timedelta(days=rng.randint(90, 730))).isoformat()}
+        for _ in range(50 * scale)
+    ], concurrency)
+    return ids
+
+
+# Payload POST và PUT cho mỗi resource (Admin không có route nên không có ở đây).
+# PUT cần đủ các trường của schema Update; None = giữ nguyên.
+def crud_specs(rng, ids):
+    return {
+        "employees": (
+            lambda i: {"name": person(rng, i), "position": "cashier", "store_id": rng.choice(ids["stores"]), "is_active": True},
+            lambda i: {"name": None, "position": rng.choice(POSITIONS), "store_id": None, "is_active": None},
+        ),
+        "customers": (
+            lambda i: {"name": person(rng, i), "email": f"bench{i}.{rng.randrange(10**6)}@example.com", "is_active": True},
+            lambda i: {"name": None, "email": None, "is_active": rng.random() < 0.9},
+        ),
+        "stores": (
+            lambda i: {"name": f"Bench store {i}", "location": rng.choice(CITIES)},
+            lambda i: {"name": None, "location": rng.choice(CITIES)},
+        ),
+        "products": (
+            lambda i: {"name": f"{rng.choice(PRODUCTS)} bench {i}", "price": round(rng.uniform(5, 500), 2), "store_id": rng.choice(ids["stores"])},
+            lambda i: {"name": None, "price": round(rng.uniform(5, 500), 2), "store_id": None},
+        ),
+        "orders": (
+            lambda i: {"customer_id": rng.choice(ids["customers"]), "product_id": rng.choice(ids["products"]), "quantity": rng.randint(1, 5)},
+            lambda i: {"customer_id": None, "product_id": None, "quantity": rng.randint(1, 5)},
+        ),
+        "invoices": (
+            lambda i: {"order_id": rng.choice(ids["orders"]), "amount": round(rng.uniform(5, 2500), 2)},
+            lambda i: {"order_id": None, "amount": round(rng.uniform(5, 2500), 2)},
+        ),
+        "services": (
+            lambda i: {"name": f"Bench service {i}", "description": "Seeded by benchmark"},
+            lambda i: {"name": None, "description": f"Updated {i}"},
+        ),
+        "warranties": (
+            lambda i: {"product_id": rng.choice(ids["products"]), "service_id": rng.choice(ids["services"]),
+                       "valid_until": (NOW + timedelta(days=365)).isoformat()},
+            lambda i: {"product_id": None, "service_id": None, "valid_until": (NOW + timedelta(days=rng.randint(90, 730))).isoformat()},
+        ),
+    }
+
+
+def percentile(latencies, p):
+    return latencies[max(math.ceil(p * len(latencies)) - 1, 0)]
+
+
+# Chạy make_request(i) cho i < n với `concurrency` request đồng thời
+async def measure(make_request, n, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(n))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            r = await make_request(i)
+            latencies.append(time.perf_counter() - start)
+            if r.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": n,
+        "errors": errors,
+        "throughput_rps": round(n / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / n * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+# create / read / update / delete cho mỗi resource. read đọc ngẫu nhiên dữ liệu nền;
+# update và delete dùng các dòng vừa tạo ở bước create nên dữ liệu nền không đổi.
+async def bench_crud(n, concurrency, scale, seed, output):
+    upgrade()
+    rng = random.Random(seed)
+    results = {}
+    async with app.router.lifespan_context(app), client() as c:
+        start = time.perf_counter()
+        ids = await seed_data(c, rng, scale, concurrency)
+        seeded = time.perf_counter() - start
+        print(f"seeded {sum(len(v) for v in ids.values())} rows in {seeded:.1f}s")
+
+        print(f"{'resource':<12}{'op':<8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for resource, (create, change) in crud_specs(rng, ids).items():
+            path = f"/{resource}/"
+            created = []
+
+            async def do_create(i):
+                r = await c.post(path, json=create(i))
+                if r.status_code < 400:
+                    created.append(r.json()["id"])
+                return r
+
+            ops = {"create": await measure(do_create, n, concurrency)}
+            targets = list(created)
+            ops["read"] = await measure(lambda i: c.get(f"{path}{rng.choice(ids[resource])}"), n, concurrency)
+            ops["update"] = await measure(lambda i: c.put(f"{path}{targets[i % len(targets)]}", json=change(i)), n, concurrency)
+            ops["delete"] = await measure(lambda i: c.delete(f"{path}{targets[i]}"), len(targets), concurrency)
+            results[resource] = ops
+            for op, stats in ops.items():
+                print(f"{resource:<12}{op:<8}{stats['throughput_rps']:>10,.1f}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['errors']:>8}")
+
+    report = {
+        "started_at": datetime.utcnow().isoformat(),
+        "database": async_engine.dialect.name,
+        "requests": n,
+        "concurrency": concurrency,
+        "scale": scale,
+        "seed": seed,
+        "seed_rows": {table: len(rows) for table, rows in ids.items()},
+        "seed_seconds": round(seeded, 3),
+        "pool_size": settings.db_pool_size,
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+
+async def run(bench):
+    try:
+        await bench
+    finally:
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process API benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bulk = sub.add_parser("bulk", help="single-row vs bulk product inserts")
+    bulk.add_argument("--rows", type=int, default=2000)
+    bulk.add_argument("--batch", type=int, default=500)
+    ser = sub.add_parser("serialize", help="JSON rendering cost per list route, json vs orjson")
+    ser.add_argument("--page-size", type=int, default=50)
+    ser.add_argument("--number", type=int, default=2000)
+    crud = sub.add_parser("crud", help="throughput and p50/p99 latency of every CRUD route")
+    crud.add_argument("--requests", type=int, default=500, help="requests per route")
+    crud.add_argument("--concurrency", type=int, default=8)
+    crud.add_argument("--scale", type=int, default=1, help="seed data multiplier")
+    crud.add_argument("--seed", type=int, default=42, help="random seed")
+    crud.add_argument("--output", default="benchmark-crud.json")
+    args = parser.parse_args()
+
+    if args.command == "bulk":
+        asyncio.run(run(bench_bulk(args.rows, args.batch)))
+    elif args.command == "crud":
+        asyncio.run(run(bench_crud(args.requests, args.concurrency, args.scale, args.seed, args.output)))
+    elif args.command == "serialize":
+        bench_serialization(args.page_size, args.number)
+
+
+if __name__ == "__main__":
+    main()
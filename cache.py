@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+
+from config import settings
+
+
+# Cache LRU + TTL trong tiến trình cho các GET theo id.
+# Key là (tên bảng, id), value là dict các cột của dòng.
+# Mỗi worker có cache riêng: TTL giới hạn thời gian dữ liệu cũ trên các worker khác.
+class EntityCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # Tăng mỗi lần invalidate; read-through chỉ ghi vào cache nếu không có
+        # invalidate nào xảy ra trong lúc đang đọc DB
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, table: str, row_id: int):
+        key = (table, row_id)
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, table: str, row_id: int, value: dict, generation: int):
+        if generation != self.generation:
+            return
+        key = (table, row_id)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, table: str, row_id: int):
+        self.generation += 1
+        self.invalidations += 1
+        self._data.pop((table, row_id), None)
+
+    def invalidate_table(self, table: str):
+        self.generation += 1
+        self.invalidations += 1
+        for key in [key for key in self._data if key[0] == table]:
+            del self._data[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+entity_cache = EntityCache(settings.cache_max_entries, settings.cache_ttl)
@@ -0,0 +1,109 @@
+# So sánh EXPLAIN ANALYZE của các truy vấn chính khi có và không có index
+# của migration 0001_query_path_indexes. Index trigram của 0003 cũng bị bỏ ở phần
+# "không index" vì index GIN (store_id, name) dùng được cho lọc theo store_id.
+# Chỉ chạy trên DB PostgreSQL thử nghiệm:
+#   APP_DATABASE_URL=postgresql://.../explain python migrate.py
+#   APP_DATABASE_URL=postgresql://.../explain python explain_indexes.py --seed
+#
+# Phần "không index" chạy trong một transaction: DROP INDEX rồi ROLLBACK,
+# nên không phải tạo lại index sau đó.
+import argparse
+import time
+
+from sqlalchemy import text
+
+from database import engine
+from migrate import QUERY_PATH_INDEXES, SEARCH_INDEXES
+
+
+def seed(conn, stores, customers, products, orders):
+    statements = [
+        ("stores", "INSERT INTO stores (name, location) "
+                   "SELECT 'Store ' || g, 'City ' || (g % 60) FROM generate_series(1, :stores) g"),
+        ("employees", "INSERT INTO employees (name, position, store_id, is_active) "
+                      "SELECT 'Employee ' || g, 'cashier', 1 + g % :stores, true "
+                      "FROM generate_series(1, :stores * 20) g"),
+        ("customers", "INSERT INTO customers (name, email, is_active) "
+                      "SELECT 'Customer ' || g, 'customer' || g || '@example.com', true "
+                      "FROM generate_series(1, :customers) g"),
+        ("products", "INSERT INTO products (name, price, store_id) "
+                     "SELECT 'Product ' || g, round((random() * 500)::numeric, 2), 1 + g % :stores "
+                     "FROM generate_series(1, :products) g"),
+        ("services", "INSERT INTO services (name, description) "
+                     "SELECT 'Service ' || g, 'Seeded' FROM generate_series(1, 50) g"),
+        ("orders", "INSERT INTO orders (customer_id, product_id, quantity, total_price, order_date, store_id) "
+                   "SELECT s.customer, p.id, s.q, s.q * p.price, now() - random() * interval '730 days', p.store_id "
+                   "FROM (SELECT 1 + (random() * (:customers - 1))::int AS customer, "
+                   "1 + (random() * (:products - 1))::int AS product, 1 + (random() * 4)::int AS q "
+                   "FROM generate_series(1, :orders) g) s JOIN products p ON p.id = s.product"),
+        ("invoices", "INSERT INTO invoices (order_id, amount, issued_date) "
+                     "SELECT id, total_price, order_date FROM orders WHERE id % 2 = 0"),
+        ("warranties", "INSERT INTO warranties (product_id, service_id, valid_until) "
+                       "SELECT g, 1 + g % 50, now() + interval '365 days' FROM generate_series(1, :products, 3) g"),
+    ]
+    params = {"stores": stores, "customers": customers, "products": products, "orders": orders}
+    for table, statement in statements:
+        start = time.perf_counter()
+        conn.execute(text(statement), params)
+        print(f"seeded {table} in {time.perf_counter() - start:.1f}s")
+    conn.exec_driver_sql("ANALYZE")
+
+
+# Các truy vấn dùng các cột vừa đánh index; hai câu cuối là thứ Postgres chạy
+# khi kiểm tra ON DELETE cho products và orders
+QUERIES = [
+    ("order history of a customer",
+     "SELECT * FROM orders WHERE customer_id = :customer ORDER BY order_date DESC LIMIT 50"),
+    ("orders of a product",
+     "SELECT * FROM orders WHERE product_id = :product"),
+    ("invoices of an order",
+     "SELECT * FROM invoices WHERE order_id = :order"),
+    ("products of a store by name",
+     "SELECT * FROM products WHERE store_id = :store ORDER BY name LIMIT 50"),
+    ("employees of a store",
+     "SELECT * FROM employees WHERE store_id = :store"),
+    ("warranties of a product",
+     "SELECT * FROM warranties WHERE product_id = :product"),
+    ("store revenue (join orders -> products)",
+     "SELECT sum(o.total_price) FROM orders o JOIN products p ON p.id = o.product_id WHERE p.store_id = :store"),
+    ("FK check when deleting a product",
+     "SELECT 1 FROM ONLY orders x WHERE product_id = :product FOR KEY SHARE OF x"),
+    ("FK check when deleting an order",
+     "SELECT 1 FROM ONLY invoices x WHERE order_id = :order FOR KEY SHARE OF x"),
+]
+
+PARAMS = {"customer": 4242, "product": 777, "order": 123456, "store": 17}
+
+
+def explain(conn, sql):
+    rows = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + sql), PARAMS).scalars().all()
+    return rows
+
+
+def compare():
+    for title, sql in QUERIES:
+        with engine.connect() as conn:
+            with conn.begin() as trans:
+                for name in [*QUERY_PATH_INDEXES, *SEARCH_INDEXES]:
+                    conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+                before = explain(conn, sql)
+                trans.rollback()
+            after = explain(conn, sql)
+        print(f"\n=== {title}\n{sql}\n--- without indexes")
+        print("\n".join(before))
+        print("--- with indexes")
+        print("\n".join(after))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN plans with and without the query-path indexes")
+    parser.add_argument("--seed", action="store_true", help="fill the (empty) database with generated rows first")
+    parser.add_argument("--stores", type=int, default=200)
+    parser.add_argument("--customers", type=int, default=200_000)
+    parser.add_argument("--products", type=int, default=500_000)
+    parser.add_argument("--orders", type=int, default=3_000_000)
+    args = parser.parse_args()
+    if args.seed:
+        with engine.begin() as conn:
+            seed(conn, args.stores, args.customers, args.products, args.orders)
+    compare()
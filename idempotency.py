@@ -0,0 +1,86 @@
+# Idempotency-Key cho POST /orders/ và POST /invoices/.
+#   python idempotency.py purge    xóa các key đã hết hạn
+#
+# Một request có header Idempotency-Key được tra trước theo khóa chính
+# (scope, key): nếu đã có response thì trả lại nguyên văn, không INSERT lần nữa.
+# Nếu chưa có, dòng key được ghi trong cùng transaction với INSERT đơn hàng bằng
+# INSERT ... ON CONFLICT; hai request trùng chạy đồng thời sẽ chờ nhau trên khóa
+# chính, request thua rollback INSERT của mình và trả response của request thắng.
+import argparse
+import hashlib
+from datetime import datetime, timedelta
+
+import orjson
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import engine
+import models
+
+
+INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+
+def fingerprint(request: BaseModel) -> bytes:
+    return hashlib.sha256(orjson.dumps(request.model_dump(mode="json"), option=orjson.OPT_SORT_KEYS)).digest()
+
+
+# Response đã lưu cho key (None nếu chưa có hoặc đã hết hạn); 422 nếu key
+# đã được dùng cho một body khác
+async def replay(db: AsyncSession, scope: str, key: str, request: BaseModel):
+    record = (await db.execute(
+        select(models.IdempotencyKey.fingerprint, models.IdempotencyKey.status_code, models.IdempotencyKey.response)
+        .where(models.IdempotencyKey.scope == scope, models.IdempotencyKey.key == key,
+               models.IdempotencyKey.expires_at > datetime.utcnow())
+    )).first()
+    if record is None:
+        return None
+    if record.fingerprint != fingerprint(request):
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    return Response(content=record.response, status_code=record.status_code, media_type="application/json",
+                    headers={"Idempotent-Replayed": "true"})
+
+
+# Ghi key cùng response trong transaction hiện tại (chưa commit). Trả về None nếu
+# ghi được; nếu một request khác đã giữ key thì rollback và trả response của nó.
+# Key đã hết hạn được ghi đè.
+async def record(db: AsyncSession, scope: str, key: str, request: BaseModel, result: BaseModel, status_code: int = 200):
+    now = datetime.utcnow()
+    stmt = INSERTS[db.bind.dialect.name](models.IdempotencyKey).values(
+        scope=scope,
+        key=key,
+        fingerprint=fingerprint(request),
+        status_code=status_code,
+        response=orjson.dumps(result.model_dump(mode="json")),
+        expires_at=now + timedelta(seconds=settings.idempotency_ttl),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.IdempotencyKey.scope, models.IdempotencyKey.key],
+        set_={column: stmt.excluded[column] for column in ("fingerprint", "status_code", "response", "expires_at")},
+        where=models.IdempotencyKey.expires_at <= now,
+    ).returning(models.IdempotencyKey.key)
+    if await db.scalar(stmt) is not None:
+        return None
+    await db.rollback()
+    stored = await replay(db, scope, key, request)
+    if stored is None:
+        raise HTTPException(status_code=409, detail="Idempotency-Key is in use, retry the request")
+    return stored
+
+
+def purge():
+    with engine.begin() as conn:
+        deleted = conn.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= datetime.utcnow())).rowcount
+    print(f"purged {deleted} expired idempotency keys")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Idempotency key maintenance")
+    parser.add_argument("command", choices=["purge"])
+    parser.parse_args()
+    purge()
@@ -0,0 +1,105 @@
+# Nạp catalog sản phẩm từ file CSV (cột: name,price,store_id) bằng COPY của PostgreSQL.
+#   python import_products.py catalog.csv [--chunk-size 10000] [--errors rejected.csv]
+#
+# Mỗi lô được kiểm tra bằng schemas.ProductBase và store_id phải tồn tại; các dòng
+# hợp lệ được COPY vào products qua psycopg2. Toàn bộ file nằm trong một transaction:
+# lỗi DB thì không dòng nào được ghi, dòng không hợp lệ thì bị bỏ qua và báo lại.
+import argparse
+import csv
+import io
+import sys
+import time
+
+from pydantic import ValidationError
+
+from database import engine
+import schemas
+
+
+# FORCE_NOT_NULL: tên rỗng được ghi là chuỗi rỗng, không thành NULL
+COPY_PRODUCTS = "COPY products (name, price, store_id) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (name))"
+
+
+def chunks(reader, size):
+    chunk = []
+    # Dòng 1 là header
+    for line_no, row in enumerate(reader, start=2):
+        chunk.append((line_no, row))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_chunk(chunk, store_ids):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    valid, errors = 0, []
+    for line_no, row in chunk:
+        try:
+            product = schemas.ProductBase.model_validate(row)
+        except ValidationError as exc:
+            errors.append((line_no, "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())))
+            continue
+        if product.store_id not in store_ids:
+            errors.append((line_no, f"store_id: store {product.store_id} not found"))
+            continue
+        writer.writerow((product.name, product.price, product.store_id))
+        valid += 1
+    buffer.seek(0)
+    return buffer, valid, errors
+
+
+def import_products(path, chunk_size):
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("COPY import needs PostgreSQL")
+    start = time.perf_counter()
+    read = imported = 0
+    rejected = []
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM stores")
+        store_ids = {row[0] for row in cursor.fetchall()}
+        with open(path, newline="", encoding="utf-8") as f:
+            for chunk in chunks(csv.DictReader(f), chunk_size):
+                buffer, valid, errors = validate_chunk(chunk, store_ids)
+                if valid:
+                    cursor.copy_expert(COPY_PRODUCTS, buffer)
+                read += len(chunk)
+                imported += valid
+                rejected.extend(errors)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return read, imported, rejected, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load products from CSV with COPY")
+    parser.add_argument("path", help="CSV file with a name,price,store_id header")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--errors", help="write rejected rows (line, error) to this CSV file")
+    args = parser.parse_args()
+
+    read, imported, rejected, elapsed = import_products(args.path, args.chunk_size)
+    print(f"read {read} rows, imported {imported}, rejected {len(rejected)} "
+          f"in {elapsed:.2f}s ({imported / elapsed:,.0f} rows/s)")
+    if args.errors:
+        with open(args.errors, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("line", "error"))
+            writer.writerows(rejected)
+    else:
+        for line_no, error in rejected[:20]:
+            print(f"  line {line_no}: {error}", file=sys.stderr)
+        if len(rejected) > 20:
+            print(f"  ... {len(rejected) - 20} more (use --errors to save all)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
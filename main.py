@@ -1,430 +1,825 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Body, Depends, Header, HTTPException, Query, Request, Response, status
+from pydantic import ValidationError
 from pydantic import BaseModel
-from typing import List, Annotated, Optional
+from typing import Any, List, Annotated, Literal, Optional
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from database import engine, SessionLocal
+from config import settings
+from cache import entity_cache
+from metrics import MetricsMiddleware, instrument, metrics
+import profiler
+from database import AsyncSessionLocal, async_engine, db_ping, get_db, pool_stats, warm_pool
+import idempotency
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from sqlalchemy import Integer, delete, exists, func, insert, literal, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from datetime import date, datetime, timedelta
 from sqlalchemy import create_engine
 from sqlalchemy.exc import IntegrityError
 from typing import List, Annotated
+from contextlib import asynccontextmanager
+import asyncio
+import csv
+import io
+import logging
+import orjson
 import models 
 import schemas
 
 
 
 
-# FastAPI application instance
-app = FastAPI()
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
 
+# Khởi động worker: schema do `python migrate.py` quản lý, ở đây chỉ làm nóng
+# connection pool rồi bật app.state.ready; tắt: đóng mọi connection của pool.
+# DB chậm hoặc không kết nối được không chặn khởi động, các connection sẽ được
+# mở dần theo request như bình thường.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    warmup = settings.db_pool_size if settings.db_pool_warmup is None else settings.db_pool_warmup
+    if warmup:
+        try:
+            await asyncio.wait_for(warm_pool(warmup), timeout=settings.db_pool_timeout)
+        except Exception as exc:
+            logger.warning("connection pool warm-up failed: %r", exc)
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    await async_engine.dispose()
 
 
-# Dependency để lấy session của DB
-def get_db():
-    db = SessionLocal()
+# FastAPI application instance
+# orjson cho mọi response: datetime được ghi dạng ISO 8601 như encoder mặc định
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+instrument(async_engine.sync_engine)
+if settings.sql_profiler:
+    app.add_middleware(profiler.ProfilerMiddleware)
+    profiler.instrument(async_engine.sync_engine)
+
+
+# Phân trang keyset: WHERE id > after_id ORDER BY id LIMIT n
+# Trang sâu có chi phí như trang đầu (không dùng OFFSET)
+async def keyset_page(db: AsyncSession, model, filters, after_id: Optional[int], limit: int):
+    stmt = select(model).where(*filters)
+    if after_id is not None:
+        stmt = stmt.where(model.id > after_id)
+    rows = (await db.scalars(stmt.order_by(model.id).limit(limit + 1))).all()
+    next_after_id = rows[limit - 1].id if len(rows) > limit else None
+    return {"items": rows[:limit], "next_after_id": next_after_id}
+
+
+# Tạo hàng loạt: kiểm tra từng phần tử, lỗi được báo theo index
+def validate_bulk_items(schema, items: List[Any]):
+    if len(items) > settings.bulk_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {settings.bulk_max_items} items per request")
+    valid, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, schema.model_validate(item)))
+        except ValidationError as exc:
+            errors.append({"index": index, "detail": exc.errors(include_url=False, include_context=False)})
+    return valid, errors
+
+
+async def existing_ids(db: AsyncSession, column, ids):
+    if not ids:
+        return set()
+    return set((await db.scalars(select(column).where(column.in_(ids)))).all())
+
+
+# INSERT ... RETURNING: lấy id và giá trị mặc định ngay trong câu INSERT,
+# không cần SELECT lại sau commit
+async def insert_returning(db: AsyncSession, model, values: dict):
+    created = await db.scalar(insert(model).values(**values).returning(model))
+    await db.commit()
+    return created
+
+
+# Các cột của một object ORM dưới dạng dict (không chạm tới relationship)
+def row_dict(obj) -> dict:
+    return {column.key: getattr(obj, column.key) for column in obj.__mapper__.column_attrs}
+
+
+# GET theo id: đọc các cột bằng Core (không tạo object ORM); với cached=True thì
+# đọc qua cache (read-through), cache lưu dict các cột
+async def read_row(db: AsyncSession, model, row_id: int, detail: str, cached: bool = False):
+    table = model.__tablename__
+    row = entity_cache.get(table, row_id) if cached else None
+    if row is None:
+        generation = entity_cache.generation
+        found = (await db.execute(select(*model.__table__.c).where(model.id == row_id))).mappings().first()
+        if found is None:
+            raise HTTPException(status_code=404, detail=detail)
+        row = dict(found)
+        if cached:
+            entity_cache.set(table, row_id, row, generation)
+    return row
+
+
+# ETag là version của dòng; If-None-Match khớp thì trả 304 không có body
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def etag_matches(header: Optional[str], tag: str) -> bool:
+    if not header:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in header.split(",")]
+    return "*" in candidates or tag in candidates
+
+
+def conditional_get(row: dict, response: Response, if_none_match: Optional[str]):
+    tag = etag(row["version"])
+    if etag_matches(if_none_match, tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    response.headers["ETag"] = tag
+    return row
+
+
+# UPDATE ... WHERE id = :id RETURNING *: một câu lệnh, 404 nếu không có dòng nào.
+# expected_version: kiểm tra version ngay trong câu UPDATE (AND version = :v),
+# không khóa dòng; không khớp thì trả conflict_status (409 hoặc 412)
+async def update_returning(db: AsyncSession, model, row_id: int, changes: dict, detail: str,
+                           expected_version: Optional[int] = None, conflict_status: int = 409):
+    if changes:
+        stmt = update(model).where(model.id == row_id)
+        if expected_version is not None:
+            stmt = stmt.where(model.version == expected_version)
+        stmt = stmt.values(**changes, version=model.version + 1).returning(model)
+        row = await db.scalar(stmt, execution_options={"synchronize_session": False})
+        await db.commit()
+        if row is not None:
+            entity_cache.invalidate(model.__tablename__, row_id)
+    else:
+        row = await db.get(model, row_id)
+        if row is not None and expected_version is not None and row.version != expected_version:
+            row = None
+    if row is None:
+        if expected_version is not None:
+            current = await db.scalar(select(model.version).where(model.id == row_id))
+            if current is not None:
+                raise HTTPException(status_code=conflict_status, detail=f"Version mismatch: expected {expected_version}, current {current}")
+        raise HTTPException(status_code=404, detail=detail)
+    return row
+
+
+# Version mong đợi: header If-Match (412 nếu không khớp) hoặc trường version
+# trong body (409 nếu không khớp); If-Match: * chỉ yêu cầu dòng tồn tại
+def expected_version(if_match: Optional[str], body_version: Optional[int]):
+    if if_match and if_match.strip() != "*":
+        try:
+            return int(if_match.strip().strip('"')), 412
+        except ValueError:
+            raise HTTPException(status_code=412, detail="If-Match must be an ETag returned by this API")
+    return body_version, 409
+
+
+# DELETE ... WHERE id = :id RETURNING id: 404 quyết định từ kết quả, không nạp object.
+# nullify: các cột khóa ngoại được set NULL trước khi xóa, như ORM vẫn làm
+# với các relationship một-nhiều (Store.employees, Customer.orders, ...)
+# cascade: các dòng con bị xóa cùng (Order.lines)
+async def delete_returning(db: AsyncSession, model, row_id: int, detail: str, nullify=(), cascade=()):
+    for column in nullify:
+        values = {column.name: None}
+        if "version" in column.table.c:
+            values["version"] = column.table.c.version + 1
+        await db.execute(update(column.table).where(column == row_id).values(values))
+    for column in cascade:
+        await db.execute(delete(column.table).where(column == row_id))
+    deleted = await db.scalar(delete(model).where(model.id == row_id).returning(model.id))
+    if deleted is None:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail=detail)
+    await db.commit()
+    entity_cache.invalidate(model.__tablename__, row_id)
+    for column in nullify:
+        entity_cache.invalidate_table(column.table.name)
+
+
+# Chỉ cập nhật các trường client gửi giá trị khác None
+def changed_fields(update_schema) -> dict:
+    return {var: value for var, value in update_schema.model_dump().items() if value is not None}
+
+
+# Một câu INSERT ... VALUES (...), (...) RETURNING cho cả lô, trong một transaction
+async def bulk_insert(db: AsyncSession, model, rows: List[dict]):
+    if not rows:
+        return []
     try:
-        yield db
-    finally:
-        db.close()
+        created = (await db.scalars(insert(model).returning(model, sort_by_parameter_order=True), rows)).all()
+        await db.commit()
+    except IntegrityError as exc:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail=f"Batch rejected: {exc.orig}")
+    return created
+
+
+# Export dạng stream: mở session riêng trong generator (session của dependency
+# đã đóng khi response bắt đầu stream) và đọc qua server-side cursor theo lô,
+# nên bộ nhớ không đổi dù export bao nhiêu dòng
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+async def stream_rows(stmt, fmt: str):
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=settings.export_batch_size))
+        if fmt == "csv":
+            yield encode_csv([list(result.keys())])
+        async for rows in result.partitions():
+            if fmt == "csv":
+                yield encode_csv([[value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows])
+            else:
+                yield b"".join(orjson.dumps(dict(row._mapping)) + b"\n" for row in rows)
+
+
+def encode_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def export_response(stmt, fmt: str, name: str):
+    return StreamingResponse(
+        stream_rows(stmt, fmt),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'},
+    )
+
+
+# Đơn thuộc một store: qua sản phẩm của đơn, hoặc qua các dòng với đơn nhiều dòng
+def order_in_store(store_id: int):
+    store_products = select(models.Product.id).where(models.Product.store_id == store_id)
+    return or_(
+        models.Order.product_id.in_(store_products),
+        exists().where(models.OrderLine.order_id == models.Order.id, models.OrderLine.product_id.in_(store_products)),
+    )
+
 
 # CRUD cho Employees
-@app.post("/employees/", response_model=schemas.EmployeeBase)
-async def create_employee(employee: schemas.EmployeeBase, db: Session = Depends(get_db)):
-    db_employee = models.Employee(name=employee.name, position=employee.position, store_id=employee.store_id)
-    db.add(db_employee)
-    db.commit()
-    db.refresh(db_employee)
-    return db_employee
+@app.post("/employees/", response_model=schemas.EmployeeRead)
+async def create_employee(employee: schemas.EmployeeBase, db: AsyncSession = Depends(get_db)):
+    return await insert_returning(db, models.Employee, employee.model_dump())
+
+@app.get("/employees/", response_model=schemas.Page[schemas.EmployeeRead])
+async def list_employees(store_id: Optional[int] = None, is_active: Optional[bool] = None, after_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    filters = []
+    if store_id is not None:
+        filters.append(models.Employee.store_id == store_id)
+    if is_active is not None:
+        filters.append(models.Employee.is_active == is_active)
+    return await keyset_page(db, models.Employee, filters, after_id, limit)
 
 @app.get("/employees/{employee_id}", response_model=schemas.EmployeeBase)
-async def read_employee(employee_id: int, db: Session = Depends(get_db)):
-    employee = db.query(models.Employee).filter(models.Employee.id == employee_id).first()
-    if not employee:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    return employee
-
-@app.put("/employees/{employee_id}", response_model=schemas.EmployeeBase)
-async def update_employee(employee_id: int, employee_update: schemas.EmployeeUpdate, db: Session = Depends(get_db)):
-    employee = db.query(models.Employee).filter(models.Employee.id == employee_id).first()
-    if not employee:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    
-    for var, value in vars(employee_update).items():
-        if value or value is not None:
-            setattr(employee, var, value)
-    
-    db.commit()
-    db.refresh(employee)
-    return employee
+async def read_employee(employee_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    row = await read_row(db, models.Employee, employee_id, "Employee not found")
+    return conditional_get(row, response, if_none_match)
+
+@app.put("/employees/{employee_id}", response_model=schemas.EmployeeRead)
+async def update_employee(employee_id: int, employee_update: schemas.EmployeeUpdate, db: AsyncSession = Depends(get_db)):
+    return await update_returning(db, models.Employee, employee_id, changed_fields(employee_update), "Employee not found")
 
 @app.delete("/employees/{employee_id}", response_model=dict)
-async def delete_employee(employee_id: int, db: Session = Depends(get_db)):
-    employee = db.query(models.Employee).filter(models.Employee.id == employee_id).first()
-    if not employee:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    
-    db.delete(employee)
-    db.commit()
+async def delete_employee(employee_id: int, db: AsyncSession = Depends(get_db)):
+    await delete_returning(db, models.Employee, employee_id, "Employee not found")
     return {"detail": "Employee deleted successfully"}
 
 # CRUD cho Customers 
-@app.post("/customers/", response_model=schemas.CustomerBase)
-async def create_customer(customer: schemas.CustomerBase, db: Session = Depends(get_db)):
-    db_customer = models.Customer(name=customer.name, email=customer.email)
-    db.add(db_customer)
-    db.commit()
-    db.refresh(db_customer)
-    return db_customer
+@app.post("/customers/", response_model=schemas.CustomerRead)
+async def create_customer(customer: schemas.CustomerBase, db: AsyncSession = Depends(get_db)):
+    return await insert_returning(db, models.Customer, customer.model_dump())
+
+# POST: Tạo nhiều Customer trong một transaction
+@app.post("/customers/bulk", response_model=schemas.BulkResult[schemas.CustomerRead])
+async def create_customers_bulk(items: List[Any] = Body(...), db: AsyncSession = Depends(get_db)):
+    valid, errors = validate_bulk_items(schemas.CustomerBase, items)
+    taken = await existing_ids(db, models.Customer.email, list({c.email for _, c in valid}))
+    rows = []
+    for index, customer in valid:
+        if customer.email in taken:
+            errors.append({"index": index, "detail": "Email already registered"})
+            continue
+        taken.add(customer.email)
+        rows.append(customer.model_dump())
+    return {"created": await bulk_insert(db, models.Customer, rows), "errors": sorted(errors, key=lambda e: e["index"])}
+
+@app.get("/customers/", response_model=schemas.Page[schemas.CustomerRead])
+async def list_customers(is_active: Optional[bool] = None, email: Optional[str] = None, after_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    filters = []
+    if is_active is not None:
+        filters.append(models.Customer.is_active == is_active)
+    if email is not None:
+        filters.append(models.Customer.email == email)
+    return await keyset_page(db, models.Customer, filters, after_id, limit)
 
 @app.get("/customers/{customer_id}", response_model=schemas.CustomerBase)
-async def read_customer(customer_id: int, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    if not customer:
+async def read_customer(customer_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    row = await read_row(db, models.Customer, customer_id, "Customer not found")
+    return conditional_get(row, response, if_none_match)
+
+# GET: Lịch sử mua hàng của một Customer, mới nhất trước: keyset theo (order_date, id)
+# giảm dần để đi theo index (customer_id, order_date), before_id là đơn cuối trang trước.
+# Luôn đúng hai câu SQL dù lịch sử dài bao nhiêu: orders JOIN products và một câu
+# selectin cho các dòng (kèm sản phẩm); trang rỗng thì câu thứ hai là kiểm tra customer
+@app.get("/customers/{customer_id}/orders", response_model=schemas.OrderHistoryPage)
+async def read_customer_orders(customer_id: int, before_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    stmt = (
+        select(models.Order)
+        .options(
+            joinedload(models.Order.product),
+            selectinload(models.Order.lines).joinedload(models.OrderLine.product),
+        )
+        .where(models.Order.customer_id == customer_id)
+    )
+    if before_id is not None:
+        before_date = select(models.Order.order_date).where(models.Order.id == before_id).scalar_subquery()
+        stmt = stmt.where(tuple_(models.Order.order_date, models.Order.id) < tuple_(before_date, before_id))
+    stmt = stmt.order_by(models.Order.order_date.desc(), models.Order.id.desc()).limit(limit + 1)
+    orders = (await db.scalars(stmt)).all()
+    if not orders and await db.get(models.Customer, customer_id) is None:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return customer
+    next_before_id = orders[limit - 1].id if len(orders) > limit else None
+    return {"items": orders[:limit], "next_before_id": next_before_id}
 
-@app.put("/customers/{customer_id}", response_model=schemas.CustomerBase)
-async def update_customer(customer_id: int, customer_update: schemas.CustomerUpdate, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    if not customer:
-        raise HTTPException(status_code=404, detail="Customer not found")
-    
-    for var, value in vars(customer_update).items():
-        if value or value is not None:
-            setattr(customer, var, value)
-    
-    db.commit()
-    db.refresh(customer)
-    return customer
+@app.put("/customers/{customer_id}", response_model=schemas.CustomerRead)
+async def update_customer(customer_id: int, customer_update: schemas.CustomerUpdate, db: AsyncSession = Depends(get_db)):
+    return await update_returning(db, models.Customer, customer_id, changed_fields(customer_update), "Customer not found")
 
 @app.delete("/customers/{customer_id}", response_model=dict)
-async def delete_customer(customer_id: int, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    if not customer:
-        raise HTTPException(status_code=404, detail="Customer not found")
-    
-    db.delete(customer)
-    db.commit()
+async def delete_customer(customer_id: int, db: AsyncSession = Depends(get_db)):
+    await delete_returning(db, models.Customer, customer_id, "Customer not found", nullify=(models.Order.customer_id,))
     return {"detail": "Customer deleted successfully"}
 
 # CRUD cho Store
 # POST: Tạo một Store mới
-@app.post("/stores/", response_model=schemas.StoreBase)
-async def create_store(store: schemas.StoreBase, db: Session = Depends(get_db)):
-    db_store = models.Store(name=store.name, location=store.location)
-    db.add(db_store)
-    db.commit()
-    db.refresh(db_store)
-    return db_store
+@app.post("/stores/", response_model=schemas.StoreRead)
+async def create_store(store: schemas.StoreBase, db: AsyncSession = Depends(get_db)):
+    return await insert_returning(db, models.Store, store.model_dump())
+
+# GET: Danh sách Store (phân trang keyset)
+@app.get("/stores/", response_model=schemas.Page[schemas.StoreRead])
+async def list_stores(location: Optional[str] = None, after_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    filters = []
+    if location is not None:
+        filters.append(models.Store.location == location)
+    return await keyset_page(db, models.Store, filters, after_id, limit)
 
 # GET: Lấy thông tin một Store
 @app.get("/stores/{store_id}", response_model=schemas.StoreBase)
-async def read_store(store_id: int, db: Session = Depends(get_db)):
-    store = db.query(models.Store).filter(models.Store.id == store_id).first()
-    if not store:
-        raise HTTPException(status_code=404, detail="Store not found")
-    return store
+async def read_store(store_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    row = await read_row(db, models.Store, store_id, "Store not found", cached=True)
+    return conditional_get(row, response, if_none_match)
 
 # PUT: Cập nhật thông tin một Store
-@app.put("/stores/{store_id}", response_model=schemas.StoreBase)
-async def update_store(store_id: int, store_update: schemas.StoreUpdate, db: Session = Depends(get_db)):
-    store = db.query(models.Store).filter(models.Store.id == store_id).first()
-    if not store:
-        raise HTTPException(status_code=404, detail="Store not found")
-    
-    for var, value in vars(store_update).items():
-        if value or value is not None:
-            setattr(store, var, value)
-    
-    db.commit()
-    db.refresh(store)
-    return store
+@app.put("/stores/{store_id}", response_model=schemas.StoreRead)
+async def update_store(store_id: int, store_update: schemas.StoreUpdate, db: AsyncSession = Depends(get_db)):
+    return await update_returning(db, models.Store, store_id, changed_fields(store_update), "Store not found")
 
 # DELETE: Xóa một Store
 @app.delete("/stores/{store_id}", response_model=dict)
-async def delete_store(store_id: int, db: Session = Depends(get_db)):
-    store = db.query(models.Store).filter(models.Store.id == store_id).first()
-    if not store:
-        raise HTTPException(status_code=404, detail="Store not found")
-    
-    db.delete(store)
-    db.commit()
+async def delete_store(store_id: int, db: AsyncSession = Depends(get_db)):
+    await delete_returning(db, models.Store, store_id, "Store not found", nullify=(models.Employee.store_id, models.Product.store_id))
     return {"detail": "Store deleted successfully"}
 
 # CRUD cho Product
 # POST: Tạo một Product mới
-@app.post("/products/", response_model=schemas.ProductBase)
-async def create_product(product: schemas.ProductBase, db: Session = Depends(get_db)):
-    db_product = models.Product(name=product.name, price=product.price, store_id=product.store_id)
-    db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+@app.post("/products/", response_model=schemas.ProductRead)
+async def create_product(product: schemas.ProductBase, db: AsyncSession = Depends(get_db)):
+    return await insert_returning(db, models.Product, product.model_dump())
+
+# POST: Tạo nhiều Product trong một transaction
+@app.post("/products/bulk", response_model=schemas.BulkResult[schemas.ProductRead])
+async def create_products_bulk(items: List[Any] = Body(...), db: AsyncSession = Depends(get_db)):
+    valid, errors = validate_bulk_items(schemas.ProductBase, items)
+    stores = await existing_ids(db, models.Store.id, list({p.store_id for _, p in valid}))
+    rows = []
+    for index, product in valid:
+        if product.store_id not in stores:
+            errors.append({"index": index, "detail": "Store not found"})
+            continue
+        rows.append(product.model_dump())
+    return {"created": await bulk_insert(db, models.Product, rows), "errors": sorted(errors, key=lambda e: e["index"])}
+
+# GET: Danh sách Product (phân trang keyset)
+@app.get("/products/", response_model=schemas.Page[schemas.ProductRead])
+async def list_products(store_id: Optional[int] = None, min_price: Optional[float] = None, max_price: Optional[float] = None, after_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    filters = []
+    if store_id is not None:
+        filters.append(models.Product.store_id == store_id)
+    if min_price is not None:
+        filters.append(models.Product.price >= min_price)
+    if max_price is not None:
+        filters.append(models.Product.price <= max_price)
+    return await keyset_page(db, models.Product, filters, after_id, limit)
 
 # GET: Lấy thông tin một Product
 @app.get("/products/{product_id}", response_model=schemas.ProductBase)
-async def read_product(product_id: int, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return product
+async def read_product(product_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    row = await read_row(db, models.Product, product_id, "Product not found", cached=True)
+    return conditional_get(row, response, if_none_match)
 
 # PUT: Cập nhật thông tin một Product
-@app.put("/products/{product_id}", response_model=schemas.ProductBase)
-async def update_product(product_id: int, product_update: schemas.ProductUpdate, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    for var, value in vars(product_update).items():
-        if value or value is not None:
-            setattr(product, var, value)
-    
-    db.commit()
-    db.refresh(product)
+@app.put("/products/{product_id}", response_model=schemas.ProductRead)
+async def update_product(product_id: int, product_update: schemas.ProductUpdate, response: Response, if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    changes = changed_fields(product_update)
+    version, conflict_status = expected_version(if_match, changes.pop("version", None))
+    product = await update_returning(db, models.Product, product_id, changes, "Product not found", version, conflict_status)
+    response.headers["ETag"] = etag(product.version)
     return product
 
 # DELETE: Xóa một Product
 @app.delete("/products/{product_id}", response_model=dict)
-async def delete_product(product_id: int, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    db.delete(product)
-    db.commit()
+async def delete_product(product_id: int, db: AsyncSession = Depends(get_db)):
+    await delete_returning(db, models.Product, product_id, "Product not found", nullify=(models.Order.product_id, models.OrderLine.product_id))
     return {"detail": "Product deleted successfully"}
 
 # CRUD cho Order
 # POST: Tạo một Order mới
-@app.post("/orders/", response_model=schemas.OrderBase)
-async def create_order(order: schemas.OrderBase, db: Session = Depends(get_db)):
-    db_order = models.Order(
-        customer_id=order.customer_id,
-        product_id=order.product_id,
-        quantity=order.quantity,
-        total_price=order.total_price
-    )
-    db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+@app.post("/orders/", response_model=schemas.OrderRead)
+# total_price = Product.price * quantity, tính trong chính câu INSERT ... SELECT
+# Idempotency-Key: lần gửi lại trả response đã lưu, không tạo đơn mới
+async def create_order(order: schemas.OrderCreate, idempotency_key: Optional[str] = Header(None, max_length=255), db: AsyncSession = Depends(get_db)):
+    if idempotency_key is not None:
+        stored = await idempotency.replay(db, "orders", idempotency_key, order)
+        if stored is not None:
+            return stored
+    priced = select(
+        literal(order.customer_id, Integer),
+        models.Product.id,
+        literal(order.quantity, Integer),
+        models.Product.price * order.quantity,
+        literal(datetime.utcnow(), models.Order.order_date.type),
+        models.Product.store_id,
+    ).where(models.Product.id == order.product_id)
+    stmt = insert(models.Order).from_select(
+        ["customer_id", "product_id", "quantity", "total_price", "order_date", "store_id"], priced
+    ).returning(models.Order)
+    db_order = await db.scalar(stmt)
+    if db_order is None:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Product not found")
+    if idempotency_key is not None:
+        stored = await idempotency.record(db, "orders", idempotency_key, order, schemas.OrderRead.model_validate(db_order, from_attributes=True))
+        if stored is not None:
+            return stored
+    await db.commit()
     return db_order
 
+# Giá và store của các sản phẩm, khóa FOR SHARE tới hết transaction: một UPDATE
+# đồng thời phải chờ câu INSERT commit, nên total_price và store_id luôn khớp sản
+# phẩm lúc đơn được ghi. ORDER BY id để các transaction khóa theo cùng một thứ tự
+async def locked_products(db: AsyncSession, product_ids):
+    stmt = (
+        select(models.Product.id, models.Product.price, models.Product.store_id)
+        .where(models.Product.id.in_(product_ids))
+        .order_by(models.Product.id)
+        .with_for_update(read=True)
+    )
+    return {row.id: row for row in await db.execute(stmt)}
+
+# POST: Tạo nhiều Order trong một transaction
+@app.post("/orders/bulk", response_model=schemas.BulkResult[schemas.OrderRead])
+async def create_orders_bulk(items: List[Any] = Body(...), db: AsyncSession = Depends(get_db)):
+    valid, errors = validate_bulk_items(schemas.OrderCreate, items)
+    customers = await existing_ids(db, models.Customer.id, list({o.customer_id for _, o in valid}))
+    product_ids = list({o.product_id for _, o in valid})
+    products = await locked_products(db, product_ids) if product_ids else {}
+    rows = []
+    for index, order in valid:
+        if order.customer_id not in customers:
+            errors.append({"index": index, "detail": "Customer not found"})
+        elif order.product_id not in products:
+            errors.append({"index": index, "detail": "Product not found"})
+        else:
+            product = products[order.product_id]
+            rows.append({**order.model_dump(), "total_price": product.price * order.quantity, "store_id": product.store_id})
+    return {"created": await bulk_insert(db, models.Order, rows), "errors": sorted(errors, key=lambda e: e["index"])}
+
+# POST: Tạo một Order nhiều dòng: đọc giá, INSERT phần đầu, rồi một câu
+# INSERT nhiều dòng cho tất cả các dòng; số câu lệnh không đổi theo kích thước giỏ hàng
+@app.post("/orders/with-lines", response_model=schemas.OrderWithLinesRead)
+async def create_order_with_lines(order: schemas.OrderWithLinesCreate, db: AsyncSession = Depends(get_db)):
+    product_ids = list({line.product_id for line in order.lines})
+    products = await locked_products(db, product_ids)
+    missing = sorted(set(product_ids) - products.keys())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Products not found: {missing}")
+
+    # store_id ghi trên từng dòng; phần đầu để NULL vì giỏ hàng có thể gồm nhiều store
+    lines = [
+        {"product_id": line.product_id, "quantity": line.quantity, "store_id": products[line.product_id].store_id,
+         "unit_price": products[line.product_id].price, "line_total": products[line.product_id].price * line.quantity}
+        for line in order.lines
+    ]
+    header = await db.scalar(insert(models.Order).values(
+        customer_id=order.customer_id,
+        quantity=sum(line["quantity"] for line in lines),
+        total_price=sum(line["line_total"] for line in lines),
+    ).returning(models.Order))
+    for line in lines:
+        line["order_id"] = header.id
+    created_lines = (await db.scalars(insert(models.OrderLine).returning(models.OrderLine, sort_by_parameter_order=True), lines)).all()
+    await db.commit()
+    return {**row_dict(header), "lines": created_lines}
+
+# GET: Danh sách Order (phân trang keyset)
+@app.get("/orders/", response_model=schemas.Page[schemas.OrderRead])
+async def list_orders(customer_id: Optional[int] = None, product_id: Optional[int] = None, placed_from: Optional[datetime] = None, placed_to: Optional[datetime] = None, after_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    filters = []
+    if customer_id is not None:
+        filters.append(models.Order.customer_id == customer_id)
+    if product_id is not None:
+        filters.append(models.Order.product_id == product_id)
+    if placed_from is not None:
+        filters.append(models.Order.order_date >= placed_from)
+    if placed_to is not None:
+        filters.append(models.Order.order_date < placed_to)
+    return await keyset_page(db, models.Order, filters, after_id, limit)
+
+# GET: Export Order dạng CSV hoặc NDJSON (stream), lọc theo khoảng thời gian và store
+@app.get("/orders/export")
+async def export_orders(fmt: Literal["csv", "ndjson"] = Query("csv", alias="format"), date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, store_id: Optional[int] = None):
+    stmt = select(*models.Order.__table__.c).order_by(models.Order.id)
+    if date_from is not None:
+        stmt = stmt.where(models.Order.order_date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(models.Order.order_date < date_to)
+    if store_id is not None:
+        stmt = stmt.where(order_in_store(store_id))
+    return export_response(stmt, fmt, "orders")
+
 # GET: Lấy thông tin một Order
 @app.get("/orders/{order_id}", response_model=schemas.OrderBase)
-async def read_order(order_id: int, db: Session = Depends(get_db)):
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
-    if not order:
+async def read_order(order_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    row = await read_row(db, models.Order, order_id, "Order not found")
+    return conditional_get(row, response, if_none_match)
+
+# GET: Các dòng của một Order
+@app.get("/orders/{order_id}/lines", response_model=List[schemas.OrderLineRead])
+async def read_order_lines(order_id: int, db: AsyncSession = Depends(get_db)):
+    lines = (await db.scalars(select(models.OrderLine).where(models.OrderLine.order_id == order_id).order_by(models.OrderLine.id))).all()
+    if not lines and await db.get(models.Order, order_id) is None:
         raise HTTPException(status_code=404, detail="Order not found")
-    return order
+    return lines
 
 # PUT: Cập nhật thông tin một Order
-@app.put("/orders/{order_id}", response_model=schemas.OrderBase)
-async def update_order(order_id: int, order_update: schemas.OrderUpdate, db: Session = Depends(get_db)):
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    for var, value in vars(order_update).items():
-        if value or value is not None:
-            setattr(order, var, value)
-    
-    db.commit()
-    db.refresh(order)
+@app.put("/orders/{order_id}", response_model=schemas.OrderRead)
+async def update_order(order_id: int, order_update: schemas.OrderUpdate, response: Response, if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    changes = changed_fields(order_update)
+    version, conflict_status = expected_version(if_match, changes.pop("version", None))
+    # Đổi sản phẩm hoặc số lượng thì tính lại total_price ngay trong câu UPDATE.
+    # Đơn nhiều dòng (product_id NULL) có tổng tính từ các dòng: không cho đổi ở đây
+    if "product_id" in changes or "quantity" in changes:
+        if await db.scalar(select(exists().where(models.OrderLine.order_id == order_id))):
+            raise HTTPException(status_code=409, detail="Order has lines; product and quantity are set per line")
+        product_id = changes.get("product_id", models.Order.product_id)
+        quantity = changes.get("quantity", models.Order.quantity)
+        price = select(models.Product.price).where(models.Product.id == product_id).scalar_subquery()
+        changes["total_price"] = price * quantity
+        if "product_id" in changes:
+            changes["store_id"] = select(models.Product.store_id).where(models.Product.id == product_id).scalar_subquery()
+    order = await update_returning(db, models.Order, order_id, changes, "Order not found", version, conflict_status)
+    response.headers["ETag"] = etag(order.version)
     return order
 
 # DELETE: Xóa một Order
 @app.delete("/orders/{order_id}", response_model=dict)
-async def delete_order(order_id: int, db: Session = Depends(get_db)):
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    db.delete(order)
-    db.commit()
+async def delete_order(order_id: int, db: AsyncSession = Depends(get_db)):
+    await delete_returning(db, models.Order, order_id, "Order not found", cascade=(models.OrderLine.order_id,))
     return {"detail": "Order deleted successfully"}
 
 
 # CRUD cho Invoice
 # POST: Tạo một Invoice mới
-@app.post("/invoices/", response_model=schemas.InvoiceBase)
-async def create_invoice(invoice: schemas.InvoiceBase, db: Session = Depends(get_db)):
-    db_invoice = models.Invoice(order_id=invoice.order_id, amount=invoice.amount)
-    db.add(db_invoice)
-    db.commit()
-    db.refresh(db_invoice)
+@app.post("/invoices/", response_model=schemas.InvoiceRead)
+async def create_invoice(invoice: schemas.InvoiceBase, idempotency_key: Optional[str] = Header(None, max_length=255), db: AsyncSession = Depends(get_db)):
+    if idempotency_key is None:
+        return await insert_returning(db, models.Invoice, invoice.model_dump())
+    stored = await idempotency.replay(db, "invoices", idempotency_key, invoice)
+    if stored is not None:
+        return stored
+    db_invoice = await db.scalar(insert(models.Invoice).values(**invoice.model_dump()).returning(models.Invoice))
+    stored = await idempotency.record(db, "invoices", idempotency_key, invoice, schemas.InvoiceRead.model_validate(db_invoice, from_attributes=True))
+    if stored is not None:
+        return stored
+    await db.commit()
     return db_invoice
 
+# GET: Danh sách Invoice (phân trang keyset)
+@app.get("/invoices/", response_model=schemas.Page[schemas.InvoiceRead])
+async def list_invoices(order_id: Optional[int] = None, issued_from: Optional[datetime] = None, issued_to: Optional[datetime] = None, after_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    filters = []
+    if order_id is not None:
+        filters.append(models.Invoice.order_id == order_id)
+    if issued_from is not None:
+        filters.append(models.Invoice.issued_date >= issued_from)
+    if issued_to is not None:
+        filters.append(models.Invoice.issued_date < issued_to)
+    return await keyset_page(db, models.Invoice, filters, after_id, limit)
+
+# GET: Export Invoice dạng CSV hoặc NDJSON (stream), lọc theo khoảng thời gian và store
+@app.get("/invoices/export")
+async def export_invoices(fmt: Literal["csv", "ndjson"] = Query("csv", alias="format"), date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, store_id: Optional[int] = None):
+    stmt = select(*models.Invoice.__table__.c).order_by(models.Invoice.id)
+    if date_from is not None:
+        stmt = stmt.where(models.Invoice.issued_date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(models.Invoice.issued_date < date_to)
+    if store_id is not None:
+        stmt = stmt.where(models.Invoice.order_id.in_(select(models.Order.id).where(order_in_store(store_id))))
+    return export_response(stmt, fmt, "invoices")
+
 # GET: Lấy thông tin một Invoice
 @app.get("/invoices/{invoice_id}", response_model=schemas.InvoiceBase)
-async def read_invoice(invoice_id: int, db: Session = Depends(get_db)):
-    invoice = db.query(models.Invoice).filter(models.Invoice.id == invoice_id).first()
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    return invoice
+async def read_invoice(invoice_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    row = await read_row(db, models.Invoice, invoice_id, "Invoice not found")
+    return conditional_get(row, response, if_none_match)
 
 # PUT: Cập nhật thông tin một Invoice
-@app.put("/invoices/{invoice_id}", response_model=schemas.InvoiceBase)
-async def update_invoice(invoice_id: int, invoice_update: schemas.InvoiceUpdate, db: Session = Depends(get_db)):
-    invoice = db.query(models.Invoice).filter(models.Invoice.id == invoice_id).first()
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    
-    for var, value in vars(invoice_update).items():
-        if value or value is not None:
-            setattr(invoice, var, value)
-    
-    db.commit()
-    db.refresh(invoice)
-    return invoice
+@app.put("/invoices/{invoice_id}", response_model=schemas.InvoiceRead)
+async def update_invoice(invoice_id: int, invoice_update: schemas.InvoiceUpdate, db: AsyncSession = Depends(get_db)):
+    return await update_returning(db, models.Invoice, invoice_id, changed_fields(invoice_update), "Invoice not found")
 
 # DELETE: Xóa một Invoice
 @app.delete("/invoices/{invoice_id}", response_model=dict)
-async def delete_invoice(invoice_id: int, db: Session = Depends(get_db)):
-    invoice = db.query(models.Invoice).filter(models.Invoice.id == invoice_id).first()
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    
-    db.delete(invoice)
-    db.commit()
+async def delete_invoice(invoice_id: int, db: AsyncSession = Depends(get_db)):
+    await delete_returning(db, models.Invoice, invoice_id, "Invoice not found")
     return {"detail": "Invoice deleted successfully"}
 
 
-# POST: Tạo một Service mới
-@app.post("/services/", response_model=schemas.ServiceBase)
-async def create_service(service: schemas.ServiceBase, db: Session = Depends(get_db)):
-    db_service = models.Service(name=service.name, description=service.description)
-    db.add(db_service)
-    db.commit()
-    db.refresh(db_service)
-    return db_service
-
-# GET: Lấy thông tin một Service
-@app.get("/services/{service_id}", response_model=schemas.ServiceBase)
-async def read_service(service_id: int, db: Session = Depends(get_db)):
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
-    if not service:
-        raise HTTPException(status_code=404, detail="Service not found")
-    return service
-
-# PUT: Cập nhật thông tin một Service
-@app.put("/services/{service_id}", response_model=schemas.ServiceBase)
-async def update_service(service_id: int, service_update: schemas.ServiceUpdate, db: Session = Depends(get_db)):
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
-    if not service:
-        raise HTTPException(status_code=404, detail="Service not found")
-    
-    for var, value in vars(service_update).items():
-        if value or value is not None:
-            setattr(service, var, value)
-    
-    db.commit()
-    db.refresh(service)
-    return service
-
-# DELETE: Xóa một Service
-@app.delete("/services/{service_id}", response_model=dict)
-async def delete_service(service_id: int, db: Session = Depends(get_db)):
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
-    if not service:
-        raise HTTPException(status_code=404, detail="Service not found")
-    
-    db.delete(service)
-    db.commit()
-    return {"detail": "Service deleted successfully"}
-
-
 # CRUD cho Service
 # POST: Tạo một Service mới
-@app.post("/services/", response_model=schemas.ServiceBase)
-async def create_service(service: schemas.ServiceBase, db: Session = Depends(get_db)):
-    db_service = models.Service(name=service.name, description=service.description)
-    db.add(db_service)
-    db.commit()
-    db.refresh(db_service)
-    return db_service
+@app.post("/services/", response_model=schemas.ServiceRead)
+async def create_service(service: schemas.ServiceBase, db: AsyncSession = Depends(get_db)):
+    return await insert_returning(db, models.Service, service.model_dump())
+
+# GET: Danh sách Service (phân trang keyset)
+@app.get("/services/", response_model=schemas.Page[schemas.ServiceRead])
+async def list_services(after_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    return await keyset_page(db, models.Service, [], after_id, limit)
 
 # GET: Lấy thông tin một Service
 @app.get("/services/{service_id}", response_model=schemas.ServiceBase)
-async def read_service(service_id: int, db: Session = Depends(get_db)):
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
-    if not service:
-        raise HTTPException(status_code=404, detail="Service not found")
-    return service
+async def read_service(service_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    row = await read_row(db, models.Service, service_id, "Service not found", cached=True)
+    return conditional_get(row, response, if_none_match)
 
 # PUT: Cập nhật thông tin một Service
-@app.put("/services/{service_id}", response_model=schemas.ServiceBase)
-async def update_service(service_id: int, service_update: schemas.ServiceUpdate, db: Session = Depends(get_db)):
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
-    if not service:
-        raise HTTPException(status_code=404, detail="Service not found")
-    
-    for var, value in vars(service_update).items():
-        if value or value is not None:
-            setattr(service, var, value)
-    
-    db.commit()
-    db.refresh(service)
-    return service
+@app.put("/services/{service_id}", response_model=schemas.ServiceRead)
+async def update_service(service_id: int, service_update: schemas.ServiceUpdate, db: AsyncSession = Depends(get_db)):
+    return await update_returning(db, models.Service, service_id, changed_fields(service_update), "Service not found")
 
 # DELETE: Xóa một Service
 @app.delete("/services/{service_id}", response_model=dict)
-async def delete_service(service_id: int, db: Session = Depends(get_db)):
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
-    if not service:
-        raise HTTPException(status_code=404, detail="Service not found")
-    
-    db.delete(service)
-    db.commit()
+async def delete_service(service_id: int, db: AsyncSession = Depends(get_db)):
+    await delete_returning(db, models.Service, service_id, "Service not found")
     return {"detail": "Service deleted successfully"}
 
 
 # CRUD cho Warranty
 # POST: Tạo một Warranty mới
-@app.post("/warranties/", response_model=schemas.WarrantyBase)
-async def create_warranty(warranty: schemas.WarrantyBase, db: Session = Depends(get_db)):
-    db_warranty = models.Warranty(product_id=warranty.product_id, warranty_period=warranty.warranty_period)
-    db.add(db_warranty)
-    db.commit()
-    db.refresh(db_warranty)
-    return db_warranty
+@app.post("/warranties/", response_model=schemas.WarrantyRead)
+async def create_warranty(warranty: schemas.WarrantyBase, db: AsyncSession = Depends(get_db)):
+    return await insert_returning(db, models.Warranty, warranty.model_dump())
+
+# GET: Danh sách Warranty (phân trang keyset)
+@app.get("/warranties/", response_model=schemas.Page[schemas.WarrantyRead])
+async def list_warranties(product_id: Optional[int] = None, service_id: Optional[int] = None, valid_from: Optional[datetime] = None, after_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(get_db)):
+    filters = []
+    if product_id is not None:
+        filters.append(models.Warranty.product_id == product_id)
+    if service_id is not None:
+        filters.append(models.Warranty.service_id == service_id)
+    if valid_from is not None:
+        filters.append(models.Warranty.valid_until >= valid_from)
+    return await keyset_page(db, models.Warranty, filters, after_id, limit)
 
 # GET: Lấy thông tin một Warranty
 @app.get("/warranties/{warranty_id}", response_model=schemas.WarrantyBase)
-async def read_warranty(warranty_id: int, db: Session = Depends(get_db)):
-    warranty = db.query(models.Warranty).filter(models.Warranty.id == warranty_id).first()
-    if not warranty:
-        raise HTTPException(status_code=404, detail="Warranty not found")
-    return warranty
+async def read_warranty(warranty_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_db)):
+    row = await read_row(db, models.Warranty, warranty_id, "Warranty not found")
+    return conditional_get(row, response, if_none_match)
 
 # PUT: Cập nhật thông tin một Warranty
-@app.put("/warranties/{warranty_id}", response_model=schemas.WarrantyBase)
-async def update_warranty(warranty_id: int, warranty_update: schemas.WarrantyUpdate, db: Session = Depends(get_db)):
-    warranty = db.query(models.Warranty).filter(models.Warranty.id == warranty_id).first()
-    if not warranty:
-        raise HTTPException(status_code=404, detail="Warranty not found")
-    
-    for var, value in vars(warranty_update).items():
-        if value or value is not None:
-            setattr(warranty, var, value)
-    
-    db.commit()
-    db.refresh(warranty)
-    return warranty
+@app.put("/warranties/{warranty_id}", response_model=schemas.WarrantyRead)
+async def update_warranty(warranty_id: int, warranty_update: schemas.WarrantyUpdate, db: AsyncSession = Depends(get_db)):
+    return await update_returning(db, models.Warranty, warranty_id, changed_fields(warranty_update), "Warranty not found")
 
 # DELETE: Xóa một Warranty
 @app.delete("/warranties/{warranty_id}", response_model=dict)
-async def delete_warranty(warranty_id: int, db: Session = Depends(get_db)):
-    warranty = db.query(models.Warranty).filter(models.Warranty.id == warranty_id).first()
-    if not warranty:
-        raise HTTPException(status_code=404, detail="Warranty not found")
-    
-    db.delete(warranty)
-    db.commit()
+async def delete_warranty(warranty_id: int, db: AsyncSession = Depends(get_db)):
+    await delete_returning(db, models.Warranty, warranty_id, "Warranty not found")
     return {"detail": "Warranty deleted successfully"}
 
 
-
-
+# Tìm kiếm theo tên (PostgreSQL, index trigram của migration 0003):
+# khớp tiền tố, chuỗi con và gõ sai (word_similarity, toán tử <%).
+# Xếp hạng: tiền tố trước, rồi chuỗi con, rồi độ tương đồng
+def name_search(column, q: str):
+    name = func.lower(column)
+    term = q.lower()
+    pattern = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    prefix = name.like(pattern + "%", escape="\\")
+    substring = name.like("%" + pattern + "%", escape="\\")
+    score = func.word_similarity(term, name)
+    return or_(substring, literal(term).op("<%")(name)), [prefix.desc(), substring.desc(), score.desc()], score
+
+
+@app.get("/search/products", response_model=List[schemas.ProductSearchHit])
+async def search_products(q: str = Query(..., min_length=3), store_id: Optional[int] = None, limit: int = Query(20, ge=1), db: AsyncSession = Depends(get_db)):
+    match, ranking, score = name_search(models.Product.name, q)
+    stmt = select(models.Product, score.label("score")).where(match)
+    if store_id is not None:
+        stmt = stmt.where(models.Product.store_id == store_id)
+    stmt = stmt.order_by(*ranking, models.Product.id).limit(min(limit, settings.search_max_results))
+    return [{**row_dict(product), "score": hit_score} for product, hit_score in (await db.execute(stmt)).all()]
+
+
+@app.get("/search/customers", response_model=List[schemas.CustomerSearchHit])
+async def search_customers(q: str = Query(..., min_length=3), limit: int = Query(20, ge=1), db: AsyncSession = Depends(get_db)):
+    match, ranking, score = name_search(models.Customer.name, q)
+    stmt = select(models.Customer, score.label("score")).where(match)
+    stmt = stmt.order_by(*ranking, models.Customer.id).limit(min(limit, settings.search_max_results))
+    return [{**row_dict(customer), "score": hit_score} for customer, hit_score in (await db.execute(stmt)).all()]
+
+# Báo cáo doanh số theo ngày của một Store, đọc từ bảng tổng hợp store_daily_sales
+# date_to không bao gồm: một tháng là date_from=2024-05-01&date_to=2024-06-01
+@app.get("/reports/stores/{store_id}/daily-sales", response_model=schemas.StoreSalesReport)
+async def read_store_daily_sales(store_id: int, date_from: date, date_to: date, db: AsyncSession = Depends(get_db)):
+    if date_to <= date_from:
+        raise HTTPException(status_code=422, detail="date_to must be after date_from")
+    days = (await db.scalars(
+        select(models.StoreDailySales)
+        .where(models.StoreDailySales.store_id == store_id,
+               models.StoreDailySales.day >= date_from,
+               models.StoreDailySales.day < date_to)
+        .order_by(models.StoreDailySales.day)
+    )).all()
+    return {
+        "store_id": store_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "order_count": sum(d.order_count for d in days),
+        "quantity": sum(d.quantity for d in days),
+        "revenue": sum(d.revenue for d in days),
+        "days": days,
+    }
+
+# Liveness: tiến trình còn phục vụ được request, không chạm tới DB
+@app.get("/health/live", response_model=dict)
+async def health_live():
+    return {"status": "ok"}
+
+
+# Readiness cho load balancer: 503 khi worker chưa khởi động xong, DB không trả
+# lời kịp, hoặc pool đã hết connection liên tục quá health_pool_exhausted_after.
+# Khi pool đang hết connection thì không ping (ping sẽ phải xếp hàng chờ pool).
+@app.get("/health/ready")
+async def health_ready(request: Request):
+    pool = pool_stats()
+    body = {
+        "status": "ready",
+        "db_latency_ms": None,
+        "pool": {key: pool[key] for key in ("checked_out", "capacity", "saturation", "exhausted_for", "checkout_timeouts")},
+    }
+    if not getattr(request.app.state, "ready", False):
+        body.update(status="not_ready", reason="starting")
+    elif pool["exhausted_for"] > settings.health_pool_exhausted_after:
+        body.update(status="not_ready", reason="pool exhausted")
+    elif pool["exhausted_for"] == 0:
+        try:
+            body["db_latency_ms"] = round(await asyncio.wait_for(db_ping(), timeout=settings.health_db_timeout) * 1000, 3)
+        except Exception as exc:
+            body.update(status="not_ready", reason=f"database unavailable: {exc!r}")
+    return ORJSONResponse(body, status_code=200 if body["status"] == "ready" else 503)
+
+
+# Số liệu dạng text cho Prometheus (xem metrics.py)
+@app.get("/metrics")
+async def read_metrics():
+    return Response(content=metrics.render(pool_stats()), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# Profiler SQL: các request gần nhất (mới nhất trước), chỉ có khi APP_SQL_PROFILER=true
+@app.get("/debug/sql", response_model=list)
+async def read_sql_profiles(n_plus_one: bool = False, limit: int = Query(20, ge=1, le=100)):
+    if not settings.sql_profiler:
+        raise HTTPException(status_code=404, detail="SQL profiler is disabled")
+    profiles = [profile for profile in reversed(profiler.recent_profiles) if profile["n_plus_one"] or not n_plus_one]
+    return profiles[:limit]
+
+
+# Thống kê connection pool: checked-out, overflow, thời gian chờ
+@app.get("/stats/pool", response_model=dict)
+async def read_pool_stats():
+    return pool_stats()
+
+
+# Thống kê cache: hit, miss, eviction
+@app.get("/stats/cache", response_model=dict)
+async def read_cache_stats():
+    return entity_cache.stats()
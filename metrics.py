@@ -0,0 +1,157 @@
+# Số liệu Prometheus cho API, xuất ở GET /metrics:
+#   - độ trễ theo (method, route) dạng histogram, số response theo status
+#   - số request đang xử lý
+#   - số câu SQL và thời gian DB (đo bằng event before/after_cursor_execute),
+#     cộng dồn theo route của request đã chạy chúng
+# Route là template của FastAPI (/orders/{order_id}), không phải URL thật,
+# nên số nhãn không tăng theo id. Mỗi worker có số liệu riêng.
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# [số câu lệnh, thời gian DB (giây)] của request đang chạy
+request_db = ContextVar("request_db", default=None)
+
+
+class RouteStats:
+    __slots__ = ("buckets", "count", "total", "queries", "db_time")
+
+    def __init__(self):
+        # buckets[i]: số request có độ trễ <= BUCKETS[i] (không cộng dồn), phần tử cuối là +Inf
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self.routes = {}
+        self.statuses = {}
+        self.in_flight = 0
+        self.queries = 0
+        self.db_time = 0.0
+
+    def observe(self, method, route, status, elapsed, queries, db_time):
+        key = (method, route)
+        stats = self.routes.get(key)
+        if stats is None:
+            stats = self.routes[key] = RouteStats()
+        stats.buckets[bisect_left(BUCKETS, elapsed)] += 1
+        stats.count += 1
+        stats.total += elapsed
+        stats.queries += queries
+        stats.db_time += db_time
+        key = (method, route, status)
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def render(self, pool: dict) -> str:
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by route.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), stats in sorted(self.routes.items()):
+            labels = f'method="{method}",route="{route}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {stats.total:.6f}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {stats.count}")
+
+        lines += ["# HELP http_responses_total Responses by route and status code.",
+                  "# TYPE http_responses_total counter"]
+        for (method, route, status), count in sorted(self.statuses.items()):
+            lines.append(f'http_responses_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+
+        lines += ["# HELP http_requests_in_flight Requests currently being handled.",
+                  "# TYPE http_requests_in_flight gauge",
+                  f"http_requests_in_flight {self.in_flight}"]
+
+        lines += ["# HELP db_queries_total SQL statements executed, by route of the request.",
+                  "# TYPE db_queries_total counter"]
+        for (method, route), stats in sorted(self.routes.items()):
+            lines.append(f'db_queries_total{{method="{method}",route="{route}"}} {stats.queries}')
+        lines += ["# HELP db_query_seconds_total Time spent in SQL statements, by route of the request.",
+                  "# TYPE db_query_seconds_total counter"]
+        for (method, route), stats in sorted(self.routes.items()):
+            lines.append(f'db_query_seconds_total{{method="{method}",route="{route}"}} {stats.db_time:.6f}')
+        lines += ["# HELP db_queries_all_total SQL statements executed by the API engine, in or outside requests.",
+                  "# TYPE db_queries_all_total counter",
+                  f"db_queries_all_total {self.queries}",
+                  "# HELP db_query_seconds_all_total Time spent in SQL statements by the API engine.",
+                  "# TYPE db_query_seconds_all_total counter",
+                  f"db_query_seconds_all_total {self.db_time:.6f}"]
+
+        lines += ["# HELP db_pool_checked_out Connections currently checked out of the pool.",
+                  "# TYPE db_pool_checked_out gauge",
+                  f"db_pool_checked_out {pool['checked_out']}",
+                  "# HELP db_pool_capacity Pool size plus max overflow.",
+                  "# TYPE db_pool_capacity gauge",
+                  f"db_pool_capacity {pool['capacity']}",
+                  "# HELP db_pool_checkout_timeouts_total Checkouts that timed out waiting for a connection.",
+                  "# TYPE db_pool_checkout_timeouts_total counter",
+                  f"db_pool_checkout_timeouts_total {pool['checkout_timeouts']}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# Middleware ASGI thuần (không qua BaseHTTPMiddleware): chỉ bọc send để lấy status
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        db = [0, 0.0]
+        token = request_db.set(db)
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.in_flight -= 1
+            request_db.reset(token)
+            # Router của FastAPI ghi route đã khớp vào scope
+            route = scope.get("route")
+            metrics.observe(scope["method"], route.path if route is not None else "<unmatched>", status, elapsed, db[0], db[1])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    metrics.queries += 1
+    metrics.db_time += elapsed
+    db = request_db.get()
+    if db is not None:
+        db[0] += 1
+        db[1] += elapsed
+
+
+# Gắn event đếm câu SQL vào một engine (với AsyncEngine thì truyền .sync_engine)
+def instrument(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
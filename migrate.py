@@ -0,0 +1,111 @@
+# Quản lý schema của DB.
+#   python migrate.py           tạo các bảng còn thiếu rồi chạy các migration chưa áp dụng
+#   python migrate.py --list    xem migration nào đã được áp dụng
+#
+# Migration là danh sách câu SQL cho PostgreSQL, được ghi lại trong bảng
+# schema_migrations. Với DB khác (SQLite dùng cho benchmark) chỉ chạy create_all.
+import argparse
+
+from sqlalchemy import text
+
+from database import engine
+from rollup import ROLLUP_MIGRATION
+import models
+
+
+# Index cho khóa ngoại và các đường truy vấn chính.
+# products.store_id và orders.customer_id được phục vụ bởi cột đầu của index ghép.
+QUERY_PATH_INDEXES = {
+    "ix_employees_store_id": "employees (store_id)",
+    "ix_products_store_id_name": "products (store_id, name)",
+    "ix_orders_customer_id_order_date": "orders (customer_id, order_date)",
+    "ix_orders_product_id": "orders (product_id)",
+    "ix_invoices_order_id": "invoices (order_id)",
+    "ix_warranties_product_id": "warranties (product_id)",
+    "ix_warranties_service_id": "warranties (service_id)",
+}
+
+# Index trigram cho /search (cần pg_trgm); btree_gin cho phép ghép store_id vào
+# cùng index GIN, nên index của products cũng phục vụ lọc theo store_id
+SEARCH_INDEXES = {
+    "ix_products_store_id_name_trgm": "products USING gin (store_id, lower(name) gin_trgm_ops)",
+    "ix_customers_name_trgm": "customers USING gin (lower(name) gin_trgm_ops)",
+}
+
+# (id, chạy trong transaction hay không, các câu lệnh)
+# CREATE INDEX CONCURRENTLY không chạy được trong transaction và không khóa ghi bảng.
+MIGRATIONS = [
+    ("0001_query_path_indexes", False, [
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}"
+        for name, target in QUERY_PATH_INDEXES.items()
+    ]),
+    ("0002_store_daily_sales_rollup", True, ROLLUP_MIGRATION),
+    # Tìm kiếm: trigram trên lower(name)
+    ("0003_search_trigram_indexes", False, [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        *(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}" for name, target in SEARCH_INDEXES.items()),
+    ]),
+    # Cột version cho ETag; DEFAULT hằng số không phải ghi lại bảng (PostgreSQL 11+)
+    ("0004_row_versions", True, [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1"
+        for table in ("employees", "customers", "stores", "products", "orders", "invoices", "services", "warranties")
+    ]),
+    # Doanh số theo store ghi lúc tạo đơn (orders/order_lines.store_id) thay vì store
+    # hiện tại của sản phẩm; cài lại trigger và tính lại store_daily_sales
+    ("0005_rollup_store_at_write", True, ROLLUP_MIGRATION),
+]
+
+
+def applied_migrations(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "id VARCHAR PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    return set(conn.execute(text("SELECT id FROM schema_migrations")).scalars())
+
+
+def run_migration(migration_id, transactional, statements):
+    record = text("INSERT INTO schema_migrations (id) VALUES (:id)")
+    if transactional:
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.exec_driver_sql(statement)
+            conn.execute(record, {"id": migration_id})
+    else:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for statement in statements:
+                conn.exec_driver_sql(statement)
+            conn.execute(record, {"id": migration_id})
+
+
+def upgrade():
+    models.Base.metadata.create_all(bind=engine)
+    if engine.dialect.name != "postgresql":
+        print(f"{engine.dialect.name}: tables created, SQL migrations skipped")
+        return
+    with engine.begin() as conn:
+        applied = applied_migrations(conn)
+    for migration_id, transactional, statements in MIGRATIONS:
+        if migration_id in applied:
+            continue
+        print(f"applying {migration_id}")
+        run_migration(migration_id, transactional, statements)
+    print("schema up to date")
+
+
+def show():
+    with engine.begin() as conn:
+        applied = applied_migrations(conn)
+    for migration_id, _, _ in MIGRATIONS:
+        print(f"[{'x' if migration_id in applied else ' '}] {migration_id}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create tables and apply pending migrations")
+    parser.add_argument("--list", action="store_true", help="show applied and pending migrations")
+    args = parser.parse_args()
+    if args.list:
+        show()
+    else:
+        upgrade()
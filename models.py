@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Date, DateTime, Index, LargeBinary
 from database import Base 
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -13,8 +13,10 @@ class Employee(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     position = Column(String)
-    store_id = Column(Integer, ForeignKey("stores.id"))  # Relation with Store
+    store_id = Column(Integer, ForeignKey("stores.id"), index=True)  # Relation with Store
     is_active = Column(Boolean, default=True)
+    # version tăng mỗi lần cập nhật; dùng làm ETag và cho cập nhật có điều kiện
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     store = relationship("Store", back_populates="employees")
 
 # Customer Model
@@ -25,6 +27,7 @@ class Customer(Base):
     name = Column(String, index=True)
     email = Column(String, unique=True, index=True)
     is_active = Column(Boolean, default=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     orders = relationship("Order", back_populates="customer")
 
 # Admin Model
@@ -43,6 +46,7 @@ class Store(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     location = Column(String)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     employees = relationship("Employee", back_populates="store")
     products = relationship("Product", back_populates="store")
 
@@ -54,30 +58,82 @@ class Product(Base):
     name = Column(String, index=True)
     price = Column(Float)
     store_id = Column(Integer, ForeignKey("stores.id"))
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     orders = relationship("Order", back_populates="product")
     store = relationship("Store", back_populates="products")
 
+    # (store_id, name) phục vụ cả lọc theo store_id lẫn tìm theo tên trong một store
+    __table_args__ = (Index("ix_products_store_id_name", "store_id", "name"),)
+
 # Order Model
 class Order(Base):
     __tablename__ = "orders"
     
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
-    product_id = Column(Integer, ForeignKey("products.id"))
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
     quantity = Column(Integer)
     total_price = Column(Float)
     order_date = Column(DateTime, default=datetime.utcnow)
+    # Store của sản phẩm lúc ghi đơn (NULL với đơn nhiều dòng); không có khóa ngoại
+    # để doanh số đã ghi không đổi khi sản phẩm đổi store hoặc store bị xóa
+    store_id = Column(Integer)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     customer = relationship("Customer", back_populates="orders")
     product = relationship("Product", back_populates="orders")
+    lines = relationship("OrderLine", back_populates="order", cascade="all, delete-orphan")
+
+    # (customer_id, order_date) phục vụ lịch sử mua hàng và kiểm tra khóa ngoại customer_id
+    __table_args__ = (Index("ix_orders_customer_id_order_date", "customer_id", "order_date"),)
+
+# Order Line Model
+# Đơn nhiều dòng: orders giữ phần đầu (product_id NULL), mỗi sản phẩm là một dòng ở đây
+class OrderLine(Base):
+    __tablename__ = "order_lines"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
+    quantity = Column(Integer)
+    unit_price = Column(Float)
+    line_total = Column(Float)
+    store_id = Column(Integer)
+    order = relationship("Order", back_populates="lines")
+    product = relationship("Product")
+
+# Store Daily Sales Model
+# Bảng tổng hợp do trigger cập nhật (xem rollup.py); không có khóa ngoại tới
+# stores để không chặn việc xóa store
+class StoreDailySales(Base):
+    __tablename__ = "store_daily_sales"
+
+    store_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+# Idempotency-Key đã dùng cho POST tạo đơn hàng / hóa đơn (xem idempotency.py).
+# fingerprint là sha256 của body request, response là JSON đã trả về.
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String(32), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(LargeBinary, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response = Column(LargeBinary, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
 
 # Invoice Model
 class Invoice(Base):
     __tablename__ = "invoices"
     
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
     amount = Column(Float)
     issued_date = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     order = relationship("Order")
 
 # Service Model
@@ -87,14 +143,16 @@ class Service(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     description = Column(String)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
 # Warranty Model
 class Warranty(Base):
     __tablename__ = "warranties"
     
     id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey("products.id"))
-    service_id = Column(Integer, ForeignKey("services.id"))
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
+    service_id = Column(Integer, ForeignKey("services.id"), index=True)
     valid_until = Column(DateTime)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     product = relationship("Product")
     service = relationship("Service")
\ No newline at end of file
@@ -0,0 +1,126 @@
+# Profiler SQL theo request, chỉ bật khi APP_SQL_PROFILER=true (môi trường dev/test).
+# Mỗi request được ghi lại mọi câu SQL cùng thời gian chạy (qua event của engine):
+#   - header X-SQL-Count, X-SQL-Time-Ms, X-SQL-N-Plus-One trên response
+#   - GET /debug/sql: các request gần nhất kèm danh sách câu lệnh
+# Các câu SELECT có cùng "hình dạng" (bỏ giá trị hằng, gộp danh sách IN) lặp lại từ
+# sql_profiler_repeat_threshold lần trở lên trong một request bị đánh dấu là
+# nghi N+1 và được ghi log cảnh báo.
+# Header được gửi khi response bắt đầu: với response dạng stream (export), các
+# câu chạy trong lúc stream chỉ có trong /debug/sql.
+import logging
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Danh sách (câu lệnh, thời gian) của request đang chạy
+request_statements = ContextVar("request_statements", default=None)
+
+# Các request gần nhất, mới nhất ở cuối
+recent_profiles = deque(maxlen=settings.sql_profiler_history)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+# Ép kiểu kiểu PostgreSQL: asyncpg ghi tham số dạng $1::INTEGER, $2::TIMESTAMP WITHOUT TIME ZONE
+_CAST = re.compile(r"::\w+(?:\s+(?:PRECISION|VARYING|WITH(?:OUT)?\s+TIME\s+ZONE))?(?:\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?(?:\[\])*", re.I)
+_PARAM = re.compile(r"\$\d+|%\(\w+\)s|(?<!:):\w+|\?")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+# Hình dạng của câu lệnh: bỏ ép kiểu, hằng số và tham số thành ?, danh sách IN thành (...)
+def statement_shape(statement: str) -> str:
+    shape = _SPACE.sub(" ", statement).strip()
+    shape = _CAST.sub("", shape)
+    shape = _STRING.sub("?", shape)
+    shape = _PARAM.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    return _IN_LIST.sub("(...)", shape)
+
+
+def repeated_shapes(statements):
+    shapes = {}
+    for statement, elapsed in statements:
+        if statement.lstrip()[:6].upper() not in ("SELECT", "WITH"):
+            continue
+        shape = statement_shape(statement)
+        count, total = shapes.get(shape, (0, 0.0))
+        shapes[shape] = (count + 1, total + elapsed)
+    return [
+        {"shape": shape, "count": count, "total_ms": round(total * 1000, 3)}
+        for shape, (count, total) in shapes.items()
+        if count >= settings.sql_profiler_repeat_threshold
+    ]
+
+
+def summarize(method, path, route, status, statements):
+    total = sum(elapsed for _, elapsed in statements)
+    return {
+        "method": method,
+        "path": path,
+        "route": route,
+        "status": status,
+        "count": len(statements),
+        "total_ms": round(total * 1000, 3),
+        "n_plus_one": repeated_shapes(statements),
+        "statements": [{"sql": statement, "ms": round(elapsed * 1000, 3)} for statement, elapsed in statements],
+    }
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        statements = []
+        status = 500
+
+        async def send_summary(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                repeated = repeated_shapes(statements)
+                total = sum(elapsed for _, elapsed in statements)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-sql-count", str(len(statements)).encode()),
+                    (b"x-sql-time-ms", f"{total * 1000:.3f}".encode()),
+                    (b"x-sql-n-plus-one", str(sum(item["count"] for item in repeated)).encode()),
+                ]
+            await send(message)
+
+        token = request_statements.set(statements)
+        try:
+            await self.app(scope, receive, send_summary)
+        finally:
+            request_statements.reset(token)
+            route = scope.get("route")
+            profile = summarize(scope["method"], scope["path"], route.path if route is not None else None, status, statements)
+            recent_profiles.append(profile)
+            for item in profile["n_plus_one"]:
+                logger.warning("probable N+1 in %s %s: %d x %s", profile["method"], profile["path"], item["count"], item["shape"])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profiler_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = request_statements.get()
+    if statements is not None:
+        statements.append((statement, time.perf_counter() - context._profiler_start))
+
+
+# Gắn event ghi câu SQL vào một engine (với AsyncEngine thì truyền .sync_engine)
+def instrument(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,140 @@
+# Bảng tổng hợp doanh số theo cửa hàng theo ngày (store_daily_sales).
+#
+# Được cập nhật bởi trigger mức câu lệnh (transition table) trên orders và
+# order_lines, trong cùng transaction với câu lệnh ghi đơn hàng; một lô
+# INSERT nhiều dòng chỉ tạo một câu upsert cho mỗi (store, ngày).
+# Cửa hàng của một đơn là store của sản phẩm tại thời điểm ghi, được lưu vào
+# orders.store_id / order_lines.store_id khi INSERT (hoặc khi đổi sản phẩm của
+# đơn); đổi store của sản phẩm, xóa sản phẩm hay xóa store về sau không làm đổi
+# doanh số đã ghi. Ngày là ngày (UTC) của order_date. Đơn nhiều dòng được đếm
+# một lần cho mỗi store có sản phẩm trong đơn.
+#
+#   python rollup.py rebuild    tính lại toàn bộ bảng từ orders/order_lines
+import argparse
+import time
+
+from database import engine
+
+
+UPSERT = """
+-- ORDER BY: các dòng (store, ngày) luôn bị khóa theo cùng thứ tự, hai giao dịch
+-- chạm cùng nhiều store không deadlock
+INSERT INTO store_daily_sales AS s (store_id, day, order_count, quantity, revenue)
+SELECT store_id, day, sum(order_count), sum(quantity), sum(revenue) FROM ({deltas}) d
+GROUP BY store_id, day
+HAVING sum(order_count) <> 0 OR sum(quantity) <> 0 OR sum(revenue) <> 0
+ORDER BY store_id, day
+ON CONFLICT (store_id, day) DO UPDATE SET
+    order_count = s.order_count + EXCLUDED.order_count,
+    quantity = s.quantity + EXCLUDED.quantity,
+    revenue = s.revenue + EXCLUDED.revenue
+"""
+
+# Phần đóng góp của một tập dòng orders / order_lines; sign = 1 hoặc -1
+ORDER_DELTA = """
+SELECT o.store_id, o.order_date::date AS day, {sign} * count(*) AS order_count,
+       {sign} * coalesce(sum(o.quantity), 0) AS quantity, {sign} * coalesce(sum(o.total_price), 0) AS revenue
+FROM {rows} o
+WHERE o.store_id IS NOT NULL AND o.order_date IS NOT NULL
+GROUP BY 1, 2
+"""
+
+# order_date nằm ở phần đầu đơn; khi xóa đơn, các dòng được xóa trước phần đầu
+LINE_DELTA = """
+SELECT l.store_id, o.order_date::date AS day, {sign} * count(DISTINCT l.order_id) AS order_count,
+       {sign} * coalesce(sum(l.quantity), 0) AS quantity, {sign} * coalesce(sum(l.line_total), 0) AS revenue
+FROM {rows} l JOIN orders o ON o.id = l.order_id
+WHERE l.store_id IS NOT NULL AND o.order_date IS NOT NULL
+GROUP BY 1, 2
+"""
+
+
+def trigger_function(name, delta):
+    inserted = UPSERT.format(deltas=delta.format(sign=1, rows="new_rows"))
+    deleted = UPSERT.format(deltas=delta.format(sign=-1, rows="old_rows"))
+    updated = UPSERT.format(deltas=delta.format(sign=1, rows="new_rows") + " UNION ALL " + delta.format(sign=-1, rows="old_rows"))
+    return f"""
+CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {inserted};
+    ELSIF TG_OP = 'DELETE' THEN
+        {deleted};
+    ELSE
+        {updated};
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+# Transition table chỉ cho phép một sự kiện trên mỗi trigger
+TRIGGER_EVENTS = {
+    "ins": ("INSERT", "REFERENCING NEW TABLE AS new_rows"),
+    "upd": ("UPDATE", "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+    "del": ("DELETE", "REFERENCING OLD TABLE AS old_rows"),
+}
+
+
+def drop_triggers(table):
+    return [f"DROP TRIGGER IF EXISTS {table}_sales_rollup_{suffix} ON {table}" for suffix in TRIGGER_EVENTS]
+
+
+def create_triggers(table, function):
+    return [
+        f"CREATE TRIGGER {table}_sales_rollup_{suffix} AFTER {event} ON {table} {referencing} "
+        f"FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+        for suffix, (event, referencing) in TRIGGER_EVENTS.items()
+    ]
+
+
+# Cột store_id ghi lúc tạo đơn; các đơn có sẵn lấy store hiện tại của sản phẩm
+# (đơn mà sản phẩm đã bị xóa thì không còn biết store)
+STORE_COLUMNS = [
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS store_id INTEGER",
+    "ALTER TABLE order_lines ADD COLUMN IF NOT EXISTS store_id INTEGER",
+    "UPDATE orders o SET store_id = p.store_id FROM products p WHERE p.id = o.product_id AND o.store_id IS NULL",
+    "UPDATE order_lines l SET store_id = p.store_id FROM products p WHERE p.id = l.product_id AND l.store_id IS NULL",
+]
+
+
+REBUILD_STATEMENTS = [
+    "TRUNCATE store_daily_sales",
+    "INSERT INTO store_daily_sales (store_id, day, order_count, quantity, revenue) "
+    "SELECT store_id, day, sum(order_count), sum(quantity), sum(revenue) FROM ("
+    + ORDER_DELTA.format(sign=1, rows="orders") + " UNION ALL " + LINE_DELTA.format(sign=1, rows="order_lines")
+    + ") d GROUP BY store_id, day",
+]
+
+# Migration: bỏ trigger cũ, thêm cột store_id, tạo hàm + trigger, rồi nạp lại dữ
+# liệu trong cùng transaction (ALTER/CREATE TRIGGER khóa ghi trên orders nên không
+# có đơn nào bị sót). Chạy lại nhiều lần vẫn cho cùng kết quả.
+ROLLUP_MIGRATION = [
+    *drop_triggers("orders"),
+    *drop_triggers("order_lines"),
+    *STORE_COLUMNS,
+    trigger_function("orders_sales_rollup", ORDER_DELTA),
+    trigger_function("order_lines_sales_rollup", LINE_DELTA),
+    *create_triggers("orders", "orders_sales_rollup"),
+    *create_triggers("order_lines", "order_lines_sales_rollup"),
+    *REBUILD_STATEMENTS,
+]
+
+
+# Tính lại toàn bộ bảng tổng hợp; khóa ghi orders/order_lines trong lúc chạy
+def rebuild():
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.exec_driver_sql("LOCK TABLE orders, order_lines IN SHARE MODE")
+        for statement in REBUILD_STATEMENTS:
+            conn.exec_driver_sql(statement)
+        rows = conn.exec_driver_sql("SELECT count(*) FROM store_daily_sales").scalar()
+    print(f"store_daily_sales rebuilt: {rows} rows in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-store daily sales rollup")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+    rebuild()
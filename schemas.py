@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import Any, Optional, List, Generic, TypeVar
+from datetime import date, datetime
 
 
 # Employee Schema
@@ -16,6 +16,10 @@ class EmployeeUpdate(BaseModel):
     store_id: Optional[int]
     is_active: Optional[bool]
 
+class EmployeeRead(EmployeeBase):
+    id: int
+    version: int
+
 # Customer Schema
 class CustomerBase(BaseModel):
     name: str
@@ -27,6 +31,10 @@ class CustomerUpdate(BaseModel):
     email: Optional[str]
     is_active: Optional[bool]
 
+class CustomerRead(CustomerBase):
+    id: int
+    version: int
+
 # Admin Schema
 class AdminBase(BaseModel):
     name: str
@@ -47,6 +55,10 @@ class StoreUpdate(BaseModel):
     name: Optional[str]
     location: Optional[str]
 
+class StoreRead(StoreBase):
+    id: int
+    version: int
+
 # Product Schema
 class ProductBase(BaseModel):
     name: str
@@ -57,19 +69,91 @@ class ProductUpdate(BaseModel):
     name: Optional[str]
     price: Optional[float]
     store_id: Optional[int]
+    version: Optional[int] = None  # cập nhật có điều kiện: 409 nếu version đã thay đổi
+
+class ProductRead(ProductBase):
+    id: int
+    version: int
 
 # Order Schema
 class OrderBase(BaseModel):
     customer_id: int
-    product_id: int
+    product_id: Optional[int]  # None với đơn nhiều dòng
     quantity: int
     total_price: float
 
+# total_price do server tính: Product.price * quantity
+class OrderCreate(BaseModel):
+    customer_id: int
+    product_id: int
+    quantity: int
+
 class OrderUpdate(BaseModel):
     customer_id: Optional[int]
     product_id: Optional[int]
     quantity: Optional[int]
-    total_price: Optional[float]
+    version: Optional[int] = None
+
+class OrderRead(OrderBase):
+    id: int
+    version: int
+    order_date: datetime
+
+# Đơn nhiều dòng: phần đầu và tất cả các dòng được ghi trong một transaction
+class OrderLineCreate(BaseModel):
+    product_id: int
+    quantity: int
+
+# product_id thành NULL khi sản phẩm bị xóa
+class OrderLineRead(BaseModel):
+    product_id: Optional[int]
+    quantity: int
+    id: int
+    order_id: int
+    unit_price: float
+    line_total: float
+
+class OrderWithLinesCreate(BaseModel):
+    customer_id: int
+    lines: List[OrderLineCreate] = Field(min_length=1)
+
+class OrderWithLinesRead(OrderRead):
+    lines: List[OrderLineRead]
+
+# Lịch sử mua hàng của một Customer: đơn kèm sản phẩm (và các dòng với đơn nhiều dòng)
+class OrderHistoryLine(OrderLineRead):
+    product: Optional[ProductRead]
+
+class OrderHistoryItem(OrderRead):
+    product: Optional[ProductRead]
+    lines: List[OrderHistoryLine]
+
+class OrderHistoryPage(BaseModel):
+    items: List[OrderHistoryItem]
+    next_before_id: Optional[int] = None
+
+# Kết quả tìm kiếm, xếp hạng theo score
+class ProductSearchHit(ProductRead):
+    score: float
+
+class CustomerSearchHit(CustomerRead):
+    score: float
+
+# Báo cáo doanh số theo ngày của một Store (từ bảng tổng hợp)
+class DailySales(BaseModel):
+    day: date
+    order_count: int
+    quantity: int
+    revenue: float
+
+class StoreSalesReport(BaseModel):
+    store_id: int
+    date_from: date
+    date_to: date
+    order_count: int
+    quantity: int
+    revenue: float
+    days: List[DailySales]
 
 # Invoice Schema
 class InvoiceBase(BaseModel):
@@ -80,6 +164,11 @@ class InvoiceUpdate(BaseModel):
     order_id: Optional[int]
     amount: Optional[float]
 
+class InvoiceRead(InvoiceBase):
+    id: int
+    version: int
+    issued_date: datetime
+
 # Service Schema
 class ServiceBase(BaseModel):
     name: str
@@ -89,6 +178,10 @@ class ServiceUpdate(BaseModel):
     name: Optional[str]
     description: Optional[str]
 
+class ServiceRead(ServiceBase):
+    id: int
+    version: int
+
 # Warranty Schema
 class WarrantyBase(BaseModel):
     product_id: int
@@ -99,3 +192,24 @@ class WarrantyUpdate(BaseModel):
     product_id: Optional[int]
     service_id: Optional[int]
     valid_until: Optional[datetime]
+
+class WarrantyRead(WarrantyBase):
+    id: int
+    version: int
+
+# Trang kết quả cho phân trang keyset (theo id)
+T = TypeVar("T")
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_after_id: Optional[int] = None
+
+# Kết quả tạo hàng loạt: created giữ thứ tự của các phần tử hợp lệ,
+# errors báo lỗi theo vị trí (index) của từng phần tử
+class BulkError(BaseModel):
+    index: int
+    detail: Any
+
+class BulkResult(BaseModel, Generic[T]):
+    created: List[T]
+    errors: List[BulkError]
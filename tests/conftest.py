@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Các test chạy app trên một file SQLite tạm; phải đặt trước khi import config/database
+os.environ["APP_DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
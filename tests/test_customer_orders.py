@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+from sqlalchemy import event
+
+from database import async_engine
+from main import app
+from migrate import upgrade
+
+
+async def seed_customer(c, product_ids, single, multi):
+    email = f"history{single}-{multi}@example.com"
+    customer = (await c.post("/customers/", json={"name": "History", "email": email})).json()
+    for i in range(single):
+        r = await c.post("/orders/", json={"customer_id": customer["id"], "product_id": product_ids[i % 2], "quantity": 1 + i % 3})
+        r.raise_for_status()
+    for i in range(multi):
+        lines = [{"product_id": product_id, "quantity": 1 + i % 2} for product_id in product_ids]
+        r = await c.post("/orders/with-lines", json={"customer_id": customer["id"], "lines": lines})
+        r.raise_for_status()
+    return customer["id"]
+
+
+async def count_statements(c, url, params=None):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        r = await c.get(url, params=params)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    assert r.status_code == 200, r.text
+    return len(statements), r.json()
+
+
+async def history_scenario():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+        store = (await c.post("/stores/", json={"name": "Store", "location": "Ha Noi"})).json()
+        product_ids = [
+            (await c.post("/products/", json={"name": name, "price": price, "store_id": store["id"]})).json()["id"]
+            for name, price in (("Kettle", 20.0), ("Blender", 45.5), ("Iron", 15.0))
+        ]
+        short_id = await seed_customer(c, product_ids, single=1, multi=0)
+        long_id = await seed_customer(c, product_ids, single=20, multi=20)
+
+        short_count, short_page = await count_statements(c, f"/customers/{short_id}/orders")
+        long_count, long_page = await count_statements(c, f"/customers/{long_id}/orders", {"limit": 100})
+
+        seen = []
+        before_id = None
+        page_counts = set()
+        while True:
+            params = {"limit": 7} if before_id is None else {"limit": 7, "before_id": before_id}
+            count, page = await count_statements(c, f"/customers/{long_id}/orders", params)
+            page_counts.add(count)
+            seen.extend(item["id"] for item in page["items"])
+            before_id = page["next_before_id"]
+            if before_id is None:
+                break
+    return short_count, short_page, long_count, long_page, page_counts, seen
+
+
+def test_customer_history_runs_constant_number_of_statements():
+    upgrade()
+
+    async def run():
+        try:
+            return await history_scenario()
+        finally:
+            await async_engine.dispose()
+
+    short_count, short_page, long_count, long_page, page_counts, seen = asyncio.run(run())
+
+    assert len(short_page["items"]) == 1
+    assert len(long_page["items"]) == 40
+    assert sum(len(item["lines"]) for item in long_page["items"]) == 60
+    assert short_count == long_count == 2
+    assert page_counts == {2}
+
+    # Keyset trên (order_date, id): các trang nối nhau đúng thứ tự mới nhất trước, không trùng, không sót
+    assert seen == [item["id"] for item in long_page["items"]]
+    dates = [(item["order_date"], item["id"]) for item in long_page["items"]]
+    assert dates == sorted(dates, reverse=True)